@@ -11,13 +11,22 @@ from sklearn.datasets import fetch_mldata
 from collections import defaultdict
 from itertools import izip
 import cPickle as pickle
+import json
+import os
+import shutil
 import time
 import numpy
 import logging
 import math
-from features import sign_change, side_nz_distance, reduce_range
+from knn import CosineKNNClassifier
+from features import sign_change, side_nz_distance, reduce_range, \
+                     batch_sign_change, batch_side_nz_distance
 
 
+# On-disk model format (see BaseDigitClassifier.save)
+MODEL_FORMAT = "recon-digit-model"
+MODEL_VERSION = 1
+
 LOGLEVEL = logging.INFO
 logging.basicConfig()
 logger = logging.getLogger("digit")
@@ -76,20 +85,62 @@ class BaseDigitClassifier(object):
                              "'white' margins around it.")
 
     def classify_with_probabilities(self, img):
-        img = self.apply_image_preprocessing([img])[0]
-        img = self.apply_dimensionality_reduction([img])[0]
-        return zip(self.classifier.classes_,
-                   self.classifier.predict_proba(img)[0])
+        _, probabilities, _, _ = self.batch_classify_with_probabilities([img])
+        return zip(self.classifier.classes_, probabilities[0])
+
+    def batch_classify_with_probabilities(self, batch):
+        """
+        Returns (labels, probabilities, entropy, margin) for a batch of
+        images, from a single pass of the classifier:
+
+          - the most probable class of each image; for the k-NN engine the
+            same labels as `batch_classify`, for an SVC the argmax of its
+            calibrated probabilities, which can differ from `predict`;
+          - the (N, n_classes) probability matrix, with columns in the
+            order of `self.classifier.classes_`;
+          - the entropy in bits of each row;
+          - the difference between the two highest probabilities of each
+            row.
+
+        An empty batch gives empty results.
+        """
+        if len(batch) == 0:
+            probabilities = numpy.zeros((0, len(self.classifier.classes_)))
+            return [], probabilities, numpy.zeros(0), numpy.zeros(0)
+        self._check_valid_sample(batch[0])
+        batch = self.apply_image_preprocessing(batch)
+        batch = self.apply_dimensionality_reduction(batch)
+        probabilities = numpy.asarray(self.classifier.predict_proba(batch))
+        labels = self.classifier.classes_[probabilities.argmax(axis=1)]
+        return (map(int, labels), probabilities, batch_entropy(probabilities),
+                top2_margin(probabilities))
 
     @classmethod
-    def load(cls, path):
-        thing = pickle.load(open(path))
+    def load(cls, path, mmap_mode="r"):
+        """
+        Loads a model saved with `save`. The arrays are memory-mapped
+        (`mmap_mode`, see numpy.load), so processes loading the same model
+        share its pages through the OS page cache. Single-file pickles
+        saved by earlier versions are still accepted.
+        """
+        if os.path.isdir(path):
+            thing = _load_model(path, mmap_mode)
+        else:
+            with open(path, "rb") as f:
+                thing = pickle.load(f)
         if not isinstance(thing, cls):
-            raise ValueError("Wrong type in pickled file")
+            raise ValueError("Wrong type in model file")
         return thing
 
     def save(self, path):
-        pickle.dump(self, open(path), pickle.HIGHEST_PROTOCOL)
+        """
+        Saves the model as a directory: a `meta.json` header (format
+        version, class, parameters) and one .npy file per array (SVD
+        components, training vectors, support vectors, ...). For
+        estimators other than the k-NN engine (e.g. the SVC) the class and
+        the attributes that are not arrays go to a small pickle member.
+        """
+        _save_model(self, path)
 
 
 class AccurateDigitClassifier(BaseDigitClassifier):
@@ -97,10 +148,14 @@ class AccurateDigitClassifier(BaseDigitClassifier):
     A digit classifier based on a K-Nearest Neighbors classifier, using
     the raw pixels as features.
     """
-    def __init__(self):
-        self.classifier = KNeighborsClassifier(5, algorithm="brute",
-                                                metric="cosine",
-                                                weights="uniform")
+    def __init__(self, n_lists=0, n_probe=8):
+        # Same votes as KNeighborsClassifier(5, algorithm="brute",
+        # metric="cosine", weights="uniform"), on a float32 training matrix
+        # and in blocks of queries. With n_lists > 0 an approximate (IVF)
+        # index is built at train time; n_probe trades recall for speed
+        # (see CosineKNNClassifier).
+        self.classifier = CosineKNNClassifier(5, n_lists=n_lists,
+                                              n_probe=n_probe)
         #self.classifier = KNeighborsClassifier(5, algorithm="auto")
         #self.classifier = SVC()
         #self.classifier = GaussianNB()
@@ -137,20 +192,11 @@ class FastDigitClassifier(BaseDigitClassifier):
         #self.classifier = LinearSVC()
 
     def apply_image_preprocessing(self, batch):
-        xs = []
-        for img in batch:
-            top, side = sign_change(img)
-            #top = reduce_range(top)
-            #side = reduce_range(side)
-            left, right = side_nz_distance(img)
-            #left = reduce_range(left)
-            #right = reduce_range(right)
-            feat = numpy.c_[top.reshape(1, len(top)),
-                            side.reshape(1, len(side)),
-                            left.reshape(1, len(left)),
-                            right.reshape(1, len(right))]
-            xs.append(feat.ravel())
-        return numpy.array(xs)
+        # Same features as sign_change/side_nz_distance image by image,
+        # computed for the whole batch at once
+        top, side = batch_sign_change(batch)
+        left, right = batch_side_nz_distance(batch)
+        return numpy.c_[top, side, left, right]
 
     def train_dimensionality_reduction(self, features):
         self.dimred = TruncatedSVD(40)
@@ -160,6 +206,112 @@ class FastDigitClassifier(BaseDigitClassifier):
         return self.dimred.transform(features)
 
 
+def _save_model(model, path):
+    path = path.rstrip(os.sep)
+    tmp_path = "{}.tmp-{}".format(path, os.getpid())
+    os.makedirs(tmp_path)
+    try:
+        _write_model(model, tmp_path)
+    except:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    # Replace a previous model only once the new one is complete
+    old_path = None
+    if os.path.exists(path):
+        old_path = "{}.old-{}".format(path, os.getpid())
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    if old_path is not None:
+        if os.path.isdir(old_path):
+            shutil.rmtree(old_path)
+        else:
+            os.remove(old_path)
+
+
+def _write_model(model, path):
+    meta = {"format": MODEL_FORMAT, "version": MODEL_VERSION,
+            "class": model.__class__.__name__}
+
+    def save_array(name, value):
+        numpy.save(os.path.join(path, name + ".npy"),
+                   numpy.ascontiguousarray(value))
+        return name
+
+    dimred = getattr(model, "dimred", None)
+    if dimred is not None:
+        meta["dimred"] = {"n_components": dimred.n_components,
+                          "components": save_array("svd_components",
+                                                   dimred.components_)}
+
+    if isinstance(model.classifier, CosineKNNClassifier):
+        params, arrays = model.classifier.get_state()
+        meta["classifier"] = {
+            "type": "CosineKNNClassifier",
+            "params": params,
+            "arrays": dict((name, save_array("knn_" + name, value))
+                           for name, value in arrays.items())}
+    else:
+        # Other estimators (e.g. the SVC): the fitted arrays (support
+        # vectors, dual coefficients, intercepts, probA_/probB_, ...) go to
+        # .npy files and only the remaining small attributes are pickled
+        state = dict(model.classifier.__dict__)
+        arrays = {}
+        for name, value in state.items():
+            if isinstance(value, numpy.ndarray) and value.dtype != object:
+                arrays[name] = save_array("clf_" + name, state.pop(name))
+        with open(os.path.join(path, "classifier.pkl"), "wb") as f:
+            pickle.dump((model.classifier.__class__, state), f,
+                        pickle.HIGHEST_PROTOCOL)
+        meta["classifier"] = {"type": "estimator", "file": "classifier.pkl",
+                              "arrays": arrays}
+
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def _load_model(path, mmap_mode="r"):
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    if meta.get("format") != MODEL_FORMAT:
+        raise ValueError("Not a digit model: {}".format(path))
+    if meta.get("version") != MODEL_VERSION:
+        raise ValueError("Unsupported model version {}".format(
+                                                        meta.get("version")))
+    model_class = globals().get(meta["class"])
+    if not (isinstance(model_class, type) and
+            issubclass(model_class, BaseDigitClassifier)):
+        raise ValueError("Unknown model class {}".format(meta["class"]))
+
+    def load_array(name, mode=mmap_mode):
+        return numpy.load(os.path.join(path, name + ".npy"), mmap_mode=mode)
+
+    model = model_class.__new__(model_class)
+    if "dimred" in meta:
+        model.dimred = TruncatedSVD(meta["dimred"]["n_components"])
+        model.dimred.components_ = load_array(meta["dimred"]["components"])
+
+    info = meta["classifier"]
+    if info["type"] == "CosineKNNClassifier":
+        arrays = dict((name, load_array(member))
+                      for name, member in info["arrays"].items())
+        params = dict((str(k), v) for k, v in info["params"].items())
+        model.classifier = CosineKNNClassifier.from_state(params, arrays)
+    elif info["type"] == "estimator":
+        with open(os.path.join(path, info["file"]), "rb") as f:
+            estimator_class, state = pickle.load(f)
+        # libsvm asks for writable buffers: copy-on-write maps still share
+        # the pages until (never) written
+        mode = "c" if mmap_mode == "r" else mmap_mode
+        for name, member in info["arrays"].items():
+            state[str(name)] = load_array(member, mode)
+        model.classifier = estimator_class.__new__(estimator_class)
+        model.classifier.__dict__.update(state)
+    else:
+        raise ValueError("Unknown classifier type {}".format(info["type"]))
+    return model
+
+
 def generate_basic_dataset(shuffle=True):
     # FIXME put this somewhere else
     data_home = "/home/rafael/media/sklearn-data"
@@ -204,5 +356,57 @@ def evaluate(classifier, data, gold):
     return float(hit) / len(data), confusion
 
 
+def evaluate_index(classifier, data, gold, probes):
+    """
+    Accuracy loss of the approximate k-NN index against the exact search.
+    For every `n_probe` in `probes` (and for the exact search) returns a
+    dict with the accuracy, the agreement with the exact predictions and
+    the classification time.
+    """
+    knn = classifier.classifier
+    n_lists = len(knn.centroids_)
+    saved = knn.n_probe
+    results = []
+    try:
+        exact = None
+        for n_probe in [n_lists] + [p for p in probes if p < n_lists]:
+            knn.n_probe = n_probe
+            start = time.time()
+            test = numpy.array(classifier.batch_classify(data))
+            elapsed = time.time() - start
+            if exact is None:
+                exact = test
+            results.append({"n_probe": n_probe,
+                            "exact": n_probe >= n_lists,
+                            "accuracy": (test == gold).mean(),
+                            "agreement": (test == exact).mean(),
+                            "time": elapsed})
+    finally:
+        knn.n_probe = saved
+    return results
+
+
 def _entropy(probabilities):
     return -sum(p * math.log(p, 2) for p in probabilities if p != 0)
+
+
+def batch_entropy(probabilities):
+    """
+    Entropy in bits of each row of an (N, n_classes) probability matrix
+    (same as `_entropy` row by row).
+    """
+    p = numpy.asarray(probabilities, dtype="float64")
+    logs = numpy.log2(numpy.where(p > 0, p, 1))
+    return -(p * logs).sum(axis=1)
+
+
+def top2_margin(probabilities):
+    """
+    Difference between the highest and the second highest probability of
+    each row of an (N, n_classes) probability matrix.
+    """
+    p = numpy.asarray(probabilities, dtype="float64")
+    if p.shape[1] < 2:
+        return p[:, 0].copy()
+    top = numpy.partition(p, p.shape[1] - 2, axis=1)[:, -2:]
+    return top[:, 1] - top[:, 0]
@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
 from digit import AccurateDigitClassifier, FastDigitClassifier, \
-                  generate_basic_dataset, evaluate, _entropy
+                  generate_basic_dataset, evaluate, evaluate_index
 import numpy
 import time
 
 if __name__ == "__main__":
     cls = AccurateDigitClassifier()
+    # Approximate k-NN: clusters the training set into n_lists lists and
+    # searches n_probe of them per digit
+    #cls = AccurateDigitClassifier(n_lists=256, n_probe=8)
     #cls = FastDigitClassifier()
     features, target, test_features, test_target = \
         generate_basic_dataset(shuffle=True)
@@ -24,15 +27,20 @@ if __name__ == "__main__":
     print "Eval time {:.4f}s".format(end - start)
     confusion = sorted(confusion.iteritems(), key=lambda x: -len(x[1]))
     print "Biggest sources of confusion:"
-    template = "\t{:<5} times guessed {} but was {}, mean entropy = {}"
+    template = ("\t{:<5} times guessed {} but was {}, "
+                "mean entropy = {:.4f}, mean margin = {:.4f}")
     for (gold, test), xs in confusion[:20]:
-        entro = []
-        try:
+        _, _, entro, margin = cls.batch_classify_with_probabilities(numpy.array(xs))
+        print template.format(len(xs), test, gold, entro.mean(), margin.mean())
 
-            for img in xs:
-                probs = [p for _, p in cls.classify_with_probabilities(img)]
-                #print "\t\t", probs
-                entro.append(_entropy(probs))
-        except:
-            pass
-        print template.format(len(xs), test, gold, numpy.array(entro).mean())
+    if getattr(cls.classifier, "centroids_", None) is not None:
+        print "Approximate index vs exact k-NN:"
+        template = "\t{:<8} accuracy {:.4f}% ({:+.4f}), agreement {:.4f}%, {:.4f}s"
+        results = evaluate_index(cls, test_features, test_target,
+                                 [1, 2, 4, 8, 16, 32])
+        exact = results[0]
+        for r in results:
+            name = "exact" if r["exact"] else "probe {}".format(r["n_probe"])
+            print template.format(name, 100 * r["accuracy"],
+                                  100 * (r["accuracy"] - exact["accuracy"]),
+                                  100 * r["agreement"], r["time"])
@@ -48,3 +48,42 @@ def reduce_range(data):
     for i, j in [(5, 11), (11, 18), (18, 24)]:
         xs.append(data[i:j].mean())
     return numpy.array(xs)
+
+
+def _as_batch(batch):
+    batch = numpy.asarray(batch)
+    return batch.reshape(len(batch), 28, 28)
+
+
+def batch_sign_change(batch):
+    """
+    `sign_change` for a whole batch: takes an (N, 784) array and returns
+    the (N, 28) `top` and `side` transition counts, equal to stacking the
+    results of `sign_change` on every image.
+    """
+    imgs = _as_batch(batch)
+    # the last row/column is compared with itself, as in shift_up/shift_left
+    top = numpy.zeros(imgs.shape, dtype=imgs.dtype)
+    numpy.bitwise_xor(imgs[:, :-1, :], imgs[:, 1:, :], out=top[:, :-1, :])
+    side = numpy.zeros(imgs.shape, dtype=imgs.dtype)
+    numpy.bitwise_xor(imgs[:, :, :-1], imgs[:, :, 1:], out=side[:, :, :-1])
+    # sign_change divides a numpy.uint64 scalar by an int, which gives a
+    # float64 (not an integer division)
+    top = numpy.true_divide(top.sum(axis=1, dtype="uint64"), 255)
+    side = numpy.true_divide(side.sum(axis=2, dtype="uint64"), 255)
+    return top, side
+
+
+def batch_side_nz_distance(batch):
+    """
+    `side_nz_distance` for a whole batch: takes an (N, 784) array and
+    returns the (N, 28) `left` and `right` distances, equal to stacking the
+    results of `side_nz_distance` on every image.
+    """
+    nz = _as_batch(batch) != 0
+    found = nz.any(axis=2)
+    first = nz.argmax(axis=2)
+    last = 27 - nz[:, :, ::-1].argmax(axis=2)
+    left = numpy.where(found, 28 - first, 0) / 28.0
+    right = numpy.where(found, last, 0) / 28.0
+    return left, right
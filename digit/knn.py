@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+import numpy
+
+
+class CosineKNNClassifier(object):
+    """
+    k-nearest neighbors classifier on cosine similarity, voting with uniform
+    weights. It gives the same predictions as
+    `KNeighborsClassifier(k, algorithm="brute", metric="cosine")`, but:
+
+      - the training matrix is normalised once and stored as float32;
+      - similarities are computed as matrix products over blocks of
+        `block_size` queries, so the working memory of a search is bounded
+        by one float32 similarity block plus the int64 index matrix of the
+        partial sort, i.e. about `12 * block_size * len(training set)`
+        bytes (~180 MB for 60k training vectors and block_size=256);
+      - only the top `k` of each row are selected (partial sort).
+
+    With `n_lists > 0` an approximate IVF index is built at fit time: the
+    training vectors are clustered (spherical k-means) into `n_lists` lists
+    and each query is only compared with the vectors of the `n_probe` lists
+    whose centroids are most similar to it. `n_probe` is the recall/speed
+    knob and can be changed after training; with `n_probe >= n_lists` the
+    search is exact again.
+    """
+    def __init__(self, n_neighbors=5, block_size=256, dtype="float32",
+                 n_lists=0, n_probe=8, n_iter=10, random_state=0):
+        self.n_neighbors = n_neighbors
+        self.block_size = block_size
+        self.dtype = dtype
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.n_iter = n_iter
+        self.random_state = random_state
+
+    _PARAMS = ("n_neighbors", "block_size", "dtype", "n_lists", "n_probe",
+               "n_iter", "random_state")
+    _ARRAYS = (("classes", "classes_"), ("labels", "_y"), ("vectors", "_fit_X"),
+               ("centroids", "centroids_"), ("order", "_order"),
+               ("offsets", "_offsets"))
+
+    def get_state(self):
+        """
+        Returns (params, arrays): the constructor parameters and the fitted
+        arrays by name, for saving the model without pickle.
+        """
+        params = dict((name, getattr(self, name)) for name in self._PARAMS)
+        arrays = {}
+        for name, attr in self._ARRAYS:
+            value = getattr(self, attr, None)
+            if value is not None:
+                arrays[name] = value
+        return params, arrays
+
+    @classmethod
+    def from_state(cls, params, arrays):
+        """
+        Rebuilds a fitted classifier from `get_state`. The arrays are used
+        as given (e.g. read-only memory maps), never copied.
+        """
+        self = cls(**params)
+        for name, attr in cls._ARRAYS:
+            setattr(self, attr, arrays.get(name))
+        return self
+
+    def _normalize(self, X):
+        X = numpy.array(X, dtype=self.dtype, ndmin=2)
+        norms = numpy.sqrt((X * X).sum(axis=1))
+        norms[norms == 0] = 1
+        X /= norms[:, numpy.newaxis]
+        return X
+
+    def fit(self, X, y):
+        self.classes_, self._y = numpy.unique(numpy.asarray(y),
+                                              return_inverse=True)
+        self._fit_X = numpy.ascontiguousarray(self._normalize(X))
+        self._order = None
+        self.centroids_ = None
+        if self.n_lists > 0:
+            self._build_index()
+        return self
+
+    def _assign(self, X, centroids):
+        # Most similar centroid of each row, in blocks of rows
+        step = max(1, self.block_size * 16)
+        return numpy.hstack([numpy.dot(X[i:i + step], centroids.T).argmax(axis=1)
+                             for i in xrange(0, len(X), step)])
+
+    def _build_index(self):
+        """
+        Spherical k-means over the normalised training vectors. The
+        training matrix is then sorted by list, so each list is a
+        contiguous slice [offsets[l], offsets[l + 1]).
+        """
+        X = self._fit_X
+        n_lists = min(self.n_lists, len(X))
+        rng = numpy.random.RandomState(self.random_state)
+        centroids = X[rng.choice(len(X), n_lists, replace=False)].copy()
+        for _ in xrange(self.n_iter):
+            assign = self._assign(X, centroids)
+            order = numpy.argsort(assign, kind="mergesort")
+            counts = numpy.bincount(assign, minlength=n_lists)
+            starts = numpy.cumsum(counts) - counts
+            nonempty = counts > 0
+            sums = numpy.add.reduceat(X[order], starts[nonempty], axis=0)
+            centroids[nonempty] = self._normalize(sums)
+            # Empty lists get a new random centroid
+            empty = numpy.flatnonzero(~nonempty)
+            if len(empty):
+                centroids[empty] = X[rng.choice(len(X), len(empty), replace=False)]
+
+        assign = self._assign(X, centroids)
+        self._order = numpy.argsort(assign, kind="mergesort")
+        self._fit_X = numpy.ascontiguousarray(X[self._order])
+        self._y = self._y[self._order]
+        self.centroids_ = centroids
+        counts = numpy.bincount(assign, minlength=n_lists)
+        self._offsets = numpy.r_[0, numpy.cumsum(counts)]
+
+    def _blocks(self, X):
+        X = self._normalize(X)
+        for start in xrange(0, len(X), self.block_size):
+            yield start, X[start:start + self.block_size]
+
+    def _exact_top_k(self, block, k):
+        # negated in place: argpartition selects the smallest values
+        similarity = numpy.dot(block, self._fit_X.T)
+        numpy.negative(similarity, out=similarity)
+        ind = numpy.argpartition(similarity, k - 1, axis=1)[:, :k]
+        rows = numpy.arange(len(block))[:, numpy.newaxis]
+        return -similarity[rows, ind], ind
+
+    def _probe_top_k(self, block, k):
+        """
+        Top k of each query among the vectors of its `n_probe` closest
+        lists. Rows with less than k candidates are padded with index -1
+        and similarity -inf.
+        """
+        n_lists = len(self.centroids_)
+        n_probe = min(self.n_probe, n_lists)
+        probe = numpy.argpartition(-numpy.dot(block, self.centroids_.T),
+                                   n_probe - 1, axis=1)[:, :n_probe]
+
+        best_sim = numpy.empty((len(block), k), dtype=self.dtype)
+        best_sim.fill(-numpy.inf)
+        best_ind = -numpy.ones((len(block), k), dtype="intp")
+        for l in numpy.unique(probe):
+            start, stop = self._offsets[l], self._offsets[l + 1]
+            if start == stop:
+                continue
+            q = numpy.flatnonzero((probe == l).any(axis=1))
+            sim = numpy.hstack((best_sim[q],
+                                numpy.dot(block[q], self._fit_X[start:stop].T)))
+            ind = numpy.hstack((best_ind[q],
+                                numpy.tile(numpy.arange(start, stop), (len(q), 1))))
+            top = numpy.argpartition(-sim, k - 1, axis=1)[:, :k]
+            rows = numpy.arange(len(q))[:, numpy.newaxis]
+            best_sim[q] = sim[rows, top]
+            best_ind[q] = ind[rows, top]
+        return best_sim, best_ind
+
+    def _top_k(self, block, k):
+        # Similarities and indices (into _fit_X) of the k best, unsorted
+        centroids = getattr(self, "centroids_", None)
+        if centroids is None or self.n_probe >= len(centroids):
+            return self._exact_top_k(block, k)
+        return self._probe_top_k(block, k)
+
+    def kneighbors(self, X, n_neighbors=None):
+        """
+        Returns (distances, indices) of the nearest training vectors, where
+        the distance is 1 - cosine similarity, as in sklearn.
+        """
+        k = n_neighbors or self.n_neighbors
+        distances, indices = [], []
+        for start, block in self._blocks(X):
+            sim, ind = self._top_k(block, k)
+            order = numpy.argsort(-sim, axis=1, kind="mergesort")
+            rows = numpy.arange(len(block))[:, numpy.newaxis]
+            sim, ind = sim[rows, order], ind[rows, order]
+            if getattr(self, "_order", None) is not None:
+                ind = numpy.where(ind >= 0, self._order[ind], -1)
+            distances.append(1 - sim)
+            indices.append(ind)
+        return numpy.vstack(distances), numpy.vstack(indices)
+
+    def _votes(self, X):
+        k = self.n_neighbors
+        n_classes = len(self.classes_)
+        votes = []
+        for start, block in self._blocks(X):
+            sim, ind = self._top_k(block, k)
+            valid = ind >= 0
+            offset = numpy.arange(len(block))[:, numpy.newaxis] * n_classes
+            labels = (self._y[ind] + offset)[valid]
+            counts = numpy.bincount(labels, minlength=len(block) * n_classes)
+            votes.append(counts.reshape(len(block), n_classes))
+        return numpy.vstack(votes)
+
+    def predict(self, X):
+        # Ties go to the smallest class, like scipy.stats.mode in sklearn
+        return self.classes_[self._votes(X).argmax(axis=1)]
+
+    def predict_proba(self, X):
+        return self._votes(X) / float(self.n_neighbors)
@@ -1,63 +1,245 @@
 # -*- encoding: utf-8 -*-
 #! /usr/bin/python
 
-from subprocess import call
 import os
+import sys
 import argparse
-import distutils.core
+import json
+import multiprocessing
+import signal
+import time
+
+# extractor de imágenes del procesamiento de telegramas (sin pdfimages);
+# se corre desde la raíz del repositorio: python -m scripts.pdf_to_image
+from telegrama.pdfimage import pdf_to_images
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+MANIFEST_NAME = 'manifest.jsonl'
+
 
 def main():
 
-    folder_path = parse_args()
-    folder_name = os.path.dirname(folder_path)
-    new_folder_path = "{0}-{1}".format(folder_name, "images")
-    pdf_to_image(folder_path, new_folder_path)
+    args = parse_args()
+    folder_path = os.path.normpath(args.folder)
+    new_folder_path = args.output
+    if new_folder_path is None:
+        new_folder_path = "{0}-{1}".format(folder_path, "images")
+    nerr = pdf_to_image(folder_path, new_folder_path, args.workers, args.force)
+    exit(1 if nerr else 0)
+
+
+def list_pdfs(folder, rel=''):
+    """list_pdfs
+    Recorre una sola vez el arbol de directorios de folder (con os.scandir si
+    esta disponible) y devuelve, ordenados, los archivos .pdf que encuentra
+    como tuplas (path relativo a folder, tamaño, fecha de modificacion).
+
+    Walks the folder tree once (with os.scandir when available) and returns
+    the .pdf files found, sorted, as (path relative to folder, size, mtime)
+    tuples.
+
+    """
+    path = os.path.join(folder, rel)
+    if scandir is not None:
+        # el stat de cada entrada lo cachea scandir (y en Windows ya viene
+        # con el listado)
+        entries = [(entry.name, entry.is_dir(), entry.stat)
+                   for entry in scandir(path)]
+    else:
+        entries = [(name, os.path.isdir(os.path.join(path, name)),
+                    lambda name=name: os.stat(os.path.join(path, name)))
+                   for name in os.listdir(path)]
 
+    found = []
+    for name, is_dir, stat in sorted(entries, key=lambda entry: entry[0]):
+        elem = os.path.join(rel, name)
+        if is_dir:
+            found.extend(list_pdfs(folder, elem))
+        elif os.path.splitext(name)[1].lower() == ".pdf":
+            st = stat()
+            found.append((elem, st.st_size, st.st_mtime))
+    return found
 
-def pdf_to_image(old_fp, new_fp):
-    """pdf_to_image  
+
+def load_manifest(path):
+    """load_manifest
+    Lee el manifiesto de una conversion anterior: devuelve un diccionario
+    path relativo del pdf -> ultima entrada registrada. Las lineas incompletas
+    se ignoran.
+
+    Reads the manifest of a previous conversion: returns a dictionary
+    relative pdf path -> last recorded entry. Incomplete lines are ignored.
+
+    """
+    entries = {}
+    if not os.path.exists(path):
+        return entries
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            entries[entry['source']] = entry
+    return entries
+
+
+def is_up_to_date(entry, pdf, new_fp):
+    """is_up_to_date
+    Indica si las imagenes de un pdf ya existen y son mas nuevas que el pdf.
+    Si el manifiesto no tiene una entrada vigente para el pdf se busca la
+    salida por defecto (<nombre>-000.pbm).
+
+    Tells whether the images of a pdf already exist and are newer than the
+    pdf. If the manifest has no current entry for it, the default output
+    (<name>-000.pbm) is checked.
+
+    """
+    rel, size, mtime = pdf
+    outputs = [os.path.splitext(rel)[0] + "-000.pbm"]
+    if entry is not None and entry.get('status') == 'ok' \
+            and entry['size'] == size and entry['mtime'] == mtime:
+        outputs = entry['outputs']
+    for name in outputs:
+        out = os.path.join(new_fp, name)
+        if not os.path.exists(out) or os.path.getmtime(out) < mtime:
+            return False
+    return True
+
+
+def _init_worker():
+    # el proceso principal se encarga de Ctrl-C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _convert(job):
+    """_convert
+    Convierte un pdf dentro de un worker y devuelve su entrada del manifiesto.
+
+    Converts a pdf inside a worker and returns its manifest entry.
+
+    """
+    old_fp, new_fp, (rel, size, mtime) = job
+    entry = {'source': rel, 'size': size, 'mtime': mtime}
+    start = time.time()
+    try:
+        new_file_path = os.path.join(new_fp, os.path.splitext(rel)[0])
+        new_dir = os.path.dirname(new_file_path)
+        if not os.path.isdir(new_dir):
+            try:
+                os.makedirs(new_dir)
+            except OSError:
+                # otro worker pudo haberlo creado
+                if not os.path.isdir(new_dir):
+                    raise
+        outputs = pdf_to_images(os.path.join(old_fp, rel), new_file_path)
+        entry['outputs'] = [os.path.relpath(out, new_fp) for out in outputs]
+        entry['status'] = 'ok'
+    except Exception, e:
+        entry['status'] = 'error'
+        entry['error'] = '%s: %s' % (e.__class__.__name__, e)
+    entry['duration'] = time.time() - start
+    return entry
+
+
+def pdf_to_image(old_fp, new_fp, workers=None, force=False):
+    """pdf_to_image
     Esta funcion transforma cada archivo .pdf de la carpeta old_fp en archivos
     .pbm en una nueva carpeta dada por el parametro new_fp. La jerarquia del
     directorio old_fp se respeta en el nuevo directorio, al igual que la
     ubicacion original de los archivos .pdf.
-    
-    This function converts each .pdf file in old_fp into .pbm files in a new 
-    folder given by the new_fp parameter. The hierarchy of old_fp directory is 
-    respected in the new directory, like the original location of the .pdf 
+
+    Las conversiones se reparten en un pool de workers procesos (por defecto
+    uno por core) y se registran en new_fp/manifest.jsonl (pdf, tamaño, fecha
+    de modificacion, archivos generados y duracion). Los pdf cuyas imagenes
+    ya existen y son mas nuevas que el pdf se saltean, salvo con force, de
+    modo que al volver a correrla solo se convierte lo que falta. Devuelve la
+    cantidad de errores.
+
+    This function converts each .pdf file in old_fp into .pbm files in a new
+    folder given by the new_fp parameter. The hierarchy of old_fp directory is
+    respected in the new directory, like the original location of the .pdf
     files.
-    
+
+    Conversions are dispatched to a pool of `workers` processes (one per core
+    by default) and recorded in new_fp/manifest.jsonl (pdf, size, mtime,
+    output files and duration). PDFs whose images already exist and are
+    newer than the pdf are skipped unless force is set, so a rerun only does
+    the missing work. Returns the number of errors.
+
     """
-    directory = os.listdir(old_fp)
-    os.mkdir("{0}".format(new_fp))
-    for elem in directory:
-        elem_path = os.path.join(old_fp, elem)
-        if os.path.isdir(elem_path):
-            elem_path = os.path.join(old_fp, elem)
-            new_elem_path = os.path.join(new_fp, elem)
-            pdf_to_image(elem_path, new_elem_path)
-        else:
-            file_name, file_ext = os.path.splitext(elem)
-            if (file_ext.find(".pdf") >= 0):
-                file_path = os.path.join(old_fp, elem)
-                new_file_path = os.path.join(new_fp, file_name)
-                call(['pdfimages', file_path, new_file_path])
+    if not os.path.isdir(new_fp):
+        os.makedirs(new_fp)
+    manifest = os.path.join(new_fp, MANIFEST_NAME)
+    done = load_manifest(manifest)
+
+    jobs = []
+    nskip = 0
+    for pdf in list_pdfs(old_fp):
+        if not force and is_up_to_date(done.get(pdf[0]), pdf, new_fp):
+            nskip += 1
+            continue
+        jobs.append((old_fp, new_fp, pdf))
+    print "pdf: %d pendientes, %d al dia" % (len(jobs), nskip)
+    if not jobs:
+        return 0
+
+    nerr = 0
+    pool = multiprocessing.Pool(workers, _init_worker)
+    try:
+        with open(manifest, 'a') as f:
+            for n, entry in enumerate(pool.imap_unordered(_convert, jobs)):
+                f.write(json.dumps(entry) + '\n')
+                f.flush()
+                if entry['status'] != 'ok':
+                    nerr += 1
+                    print >>sys.stderr, "%s: %s" % (entry['source'], entry['error'])
+                print "[%d/%d] %s (%.2fs)" % (n+1, len(jobs), entry['source'], entry['duration'])
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return nerr
 
 
 def parse_args():
 
     parser = argparse.ArgumentParser(
-        description="Para ejecutar:\n\tpython pdf_to_image.py folder"
+        description="Para ejecutar:\n\tpython -m scripts.pdf_to_image folder [output] [-j N]"
     )
     parser.add_argument("folder",
                         help="Carpeta donde se encuentran los archivos pdf",
                         type=str,
                         action="store"
                         )
+    parser.add_argument("output",
+                        help="Carpeta de salida (por defecto FOLDER-images)",
+                        nargs="?",
+                        default=None
+                        )
+    parser.add_argument("-j", "--workers",
+                        help="Cantidad de procesos (por defecto uno por core)",
+                        type=int,
+                        default=None
+                        )
+    parser.add_argument("-f", "--force",
+                        help="Convertir aunque las imagenes esten al dia",
+                        action="store_true"
+                        )
 
     args = parser.parse_args()
 
     if os.path.isdir(args.folder):
-        return args.folder
+        return args
     else:
         print "La carpeta no existe !"
         exit(1)
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Procesamiento masivo de telegramas
+#
+# Recorre el árbol del dataset y procesa cada telegrama (.pdf o .pbm) en un
+# pool de procesos que se mantienen vivos durante toda la corrida, de manera
+# que las librerías se importan una sola vez por proceso y el template se
+# compila (ver registry.py) antes de crearlos.
+#
+# La salida respeta la estructura de directorios de la entrada. Cada
+# telegrama procesado se registra en un manifiesto (una línea JSON por
+# telegrama) que funciona como checkpoint: si la corrida se interrumpe, al
+# relanzarla sólo se procesan los telegramas que faltan o cuyo archivo de
+# origen cambió. Los tiempos y la memoria de cada etapa de cada telegrama se
+# agregan a un archivo de trazas (ver tracing.py).
+#
+#   $ python telegrama/batch.py DATASET [RESULTADOS] [-j N] [-n N]
+
+import os, sys
+import argparse
+import json
+import multiprocessing
+import signal
+import time
+
+import container
+import registry
+import telegrama
+import tracing
+
+INPUT_EXT = ('.pdf', '.pbm')
+MANIFEST_NAME = 'manifest.jsonl'
+
+## Recorre el dataset y devuelve los paths (relativos) de los telegramas
+#
+# Las salidas se nombran sin la extensión de origen, así que si en un mismo
+# directorio están X.pdf y X.pbm se procesa sólo uno (el primero según el
+# orden de INPUT_EXT) y se avisa del otro.
+#
+# @param root           directorio raíz del dataset
+# @param limit          cantidad máxima de telegramas (None: todos)
+def find_telegrams(root, limit=None):
+    found = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        inputs = {}
+        for name in filenames:
+            stem, ext = os.path.splitext(name)
+            if ext.lower() in INPUT_EXT:
+                inputs.setdefault(stem, []).append(name)
+        for stem in sorted(inputs):
+            names = sorted(inputs[stem],
+                           key=lambda name: INPUT_EXT.index(os.path.splitext(name)[1].lower()))
+            rels = [os.path.relpath(os.path.join(dirpath, name), root) for name in names]
+            for rel in rels[1:]:
+                print >>sys.stderr, 'se ignora %s: misma salida que %s' % (rel, rels[0])
+            found.append(rels[0])
+            if limit is not None and len(found) >= limit:
+                return found
+    return found
+
+## Lee el manifiesto de una corrida anterior
+#
+# Devuelve un diccionario path relativo -> última entrada registrada. Las
+# líneas incompletas (p.ej. por una corrida interrumpida) se ignoran.
+#
+# @param path           path al manifiesto
+def load_manifest(path):
+    entries = {}
+    if not os.path.exists(path):
+        return entries
+    with open(path) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            entries[entry['source']] = entry
+    return entries
+
+## Indica si las salidas registradas para un telegrama siguen vigentes
+#
+# @param entry          entrada del manifiesto (o None)
+# @param src            path al archivo de origen
+# @param out_root       directorio de salida
+def is_up_to_date(entry, src, out_root):
+    if entry is None or entry.get('status') != 'ok':
+        return False
+    st = os.stat(src)
+    if entry['size'] != st.st_size or entry['mtime'] != st.st_mtime:
+        return False
+    for name in entry['outputs']:
+        out = os.path.join(out_root, name)
+        if not os.path.exists(out) or os.path.getmtime(out) < st.st_mtime:
+            return False
+    return True
+
+def _init_worker():
+    # el proceso principal se encarga de Ctrl-C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+## Procesa un telegrama dentro de un worker
+#
+# Devuelve la entrada del manifiesto; la traza del telegrama viaja en
+# entry['trace'] y la saca el proceso principal.
+#
+# @param job            (dataset, resultados, path relativo, generar vista previa,
+#                       guardar JPEG sueltos)
+def _process(job):
+    in_root, out_root, rel, preview, jpeg = job
+    src = os.path.join(in_root, rel)
+    out_base = os.path.join(out_root, os.path.splitext(rel)[0])
+    st = os.stat(src)
+    entry = {'source': rel, 'size': st.st_size, 'mtime': st.st_mtime}
+
+    tracer = tracing.Tracer(rel)
+    start = time.time()
+    try:
+        out_dir = os.path.dirname(out_base)
+        if not os.path.isdir(out_dir):
+            try:
+                os.makedirs(out_dir)
+            except OSError:
+                # otro worker pudo haberlo creado
+                if not os.path.isdir(out_dir):
+                    raise
+
+        # los pdf se leen directamente (ver pdfimage.py)
+        crops = telegrama.process_telegram(src, out_base, preview, jpeg, tracer=tracer)
+        if jpeg:
+            outputs = [out_base + '-' + name + '.jpg' for name in crops]
+        else:
+            outputs = [out_base + container.CONTAINER_SUFFIX]
+        outputs.append(out_base + '-DETECT.json')
+        if preview:
+            outputs.append(out_base + '-PREVIEW.jpg')
+        entry['outputs'] = [os.path.relpath(out, out_root) for out in outputs]
+        entry['status'] = 'ok'
+    except Exception, e:
+        entry['status'] = 'error'
+        entry['error'] = '%s: %s' % (e.__class__.__name__, e)
+
+    entry['duration'] = time.time() - start
+    entry['trace'] = tracer.record()
+    entry['trace']['status'] = entry['status']
+    return entry
+
+## Procesa todos los telegramas pendientes del dataset
+#
+# @param in_root        directorio raíz del dataset
+# @param out_root       directorio de salida
+# @param workers        cantidad de procesos (por defecto uno por core)
+# @param limit          cantidad máxima de telegramas
+# @param force          reprocesa aunque las salidas estén al día
+# @param manifest       path al manifiesto (por defecto dentro de out_root)
+# @param preview_every  genera la vista previa de uno de cada N telegramas (0: ninguno)
+# @param jpeg           guarda los recortes como JPEG sueltos en lugar del contenedor
+# @param traces         path al archivo de trazas (por defecto dentro de out_root)
+def run_batch(in_root, out_root, workers=None, limit=None, force=False, manifest=None,
+              preview_every=0, jpeg=False, traces=None):
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    if manifest is None:
+        manifest = os.path.join(out_root, MANIFEST_NAME)
+    if traces is None:
+        traces = os.path.join(out_root, tracing.TRACE_NAME)
+    if not os.path.isdir(out_root):
+        os.makedirs(out_root)
+
+    done = load_manifest(manifest)
+    jobs = []
+    nskip = 0
+    for rel in find_telegrams(in_root, limit):
+        if not force and is_up_to_date(done.get(rel), os.path.join(in_root, rel), out_root):
+            nskip += 1
+            continue
+        preview = preview_every > 0 and len(jobs) % preview_every == 0
+        jobs.append((in_root, out_root, rel, preview, jpeg))
+    print 'telegramas: %d pendientes, %d al día' % (len(jobs), nskip)
+
+    # compila el template antes de crear los workers: lo heredan ya cargado
+    registry.get_template(telegrama.model_file, telegrama.keyword_file)
+
+    nerr = 0
+    start = time.time()
+    pool = multiprocessing.Pool(workers, _init_worker)
+    try:
+        with open(manifest, 'a') as f:
+            results = pool.imap_unordered(_process, jobs)
+            for n, entry in enumerate(results):
+                tracing.write_trace(traces, entry.pop('trace'))
+                f.write(json.dumps(entry) + '\n')
+                f.flush()
+                if entry['status'] != 'ok':
+                    nerr += 1
+                    print >>sys.stderr, '%s: %s' % (entry['source'], entry['error'])
+                print '[%d/%d] %s (%.1fs)' % (n+1, len(jobs), entry['source'], entry['duration'])
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    print 'procesados: %d (%d errores) en %.1fs' % (len(jobs), nerr, time.time() - start)
+    print 'trazas por etapa: python telegrama/tracing.py', traces
+    return nerr
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Procesamiento masivo de telegramas")
+    parser.add_argument("dataset", help="directorio con los telegramas (.pdf o .pbm)")
+    parser.add_argument("results", nargs='?', default=None,
+                        help="directorio de salida (por defecto DATASET-recon)")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="cantidad de procesos (por defecto uno por core)")
+    parser.add_argument("-n", "--limit", type=int, default=None,
+                        help="procesar sólo los primeros N telegramas")
+    parser.add_argument("--manifest", default=None,
+                        help="manifiesto/checkpoint (por defecto RESULTADOS/" + MANIFEST_NAME + ")")
+    parser.add_argument("--traces", default=None,
+                        help="archivo de trazas por etapa (por defecto RESULTADOS/" +
+                             tracing.TRACE_NAME + ")")
+    parser.add_argument("-f", "--force", action="store_true",
+                        help="reprocesar aunque las salidas estén al día")
+    parser.add_argument("--preview-every", type=int, default=0, metavar="N",
+                        help="generar la vista previa de uno de cada N telegramas "
+                             "(ver también preview.py)")
+    parser.add_argument("--jpeg", action="store_true",
+                        help="guardar los recortes como JPEG sueltos (formato anterior) "
+                             "en lugar de un contenedor por telegrama (ver container.py)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    dataset = os.path.abspath(args.dataset)
+    if not os.path.isdir(dataset):
+        print >>sys.stderr, "La carpeta no existe !"
+        return 1
+    results = args.results
+    if results is None:
+        results = dataset.rstrip(os.sep) + '-recon'
+    nerr = run_batch(dataset, os.path.abspath(results), args.workers, args.limit,
+                     args.force, args.manifest, args.preview_every, args.jpeg, args.traces)
+    return 1 if nerr else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
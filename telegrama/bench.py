@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Benchmark del procesamiento de telegramas
+#
+# A partir del telegrama de ejemplo (040240351_7634.pbm) y el modelo
+# CordobaOct2013 se genera un conjunto reproducible (semilla fija) de
+# variantes sintéticas: rotaciones chicas, escalas levemente distintas, ruido
+# sal y pimienta y márgenes corridos. Sobre ese conjunto se mide:
+#
+#   -- la latencia de cada etapa y la de punta a punta (ver tracing.py),
+#      procesando de a un telegrama;
+#   -- el throughput (telegramas por segundo) con 1..N procesos;
+#   -- el pico de memoria residente por proceso.
+#
+# Los resultados se comparan con una corrida de referencia guardada con
+# --save-baseline; si alguna etapa (o el total) es más lenta que la
+# referencia por encima del umbral, o el throughput cae, el comando termina
+# con error.
+#
+#   $ python telegrama/bench.py --save-baseline     # guarda la referencia
+#   $ python telegrama/bench.py                     # compara con la referencia
+
+import os, sys
+import argparse
+import json
+import multiprocessing
+import shutil
+import signal
+import tempfile
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+import registry
+import telegrama
+import tracing
+from bitimage import PackedImage
+from geometry import Affine, warp_nearest
+from pdfimage import write_image
+
+PATH = os.path.dirname(os.path.abspath(__file__))
+
+SAMPLE_FILE = PATH + '/040240351_7634.pbm'
+BASELINE_FILE = PATH + '/bench-baseline.json'
+
+BASELINE_VERSION = 1
+
+# rango de las perturbaciones de las variantes sintéticas
+max_rotation = 2.          # grados
+max_scale_jitter = 0.03    # escala en [1 - j, 1 + j]
+max_noise = 0.002          # fracción de pixels invertidos
+max_shift = 40             # pixels
+
+## Genera una variante sintética de un telegrama
+#
+# La página se rota alrededor del centro, se escala y se desplaza (cada
+# pixel de salida toma el pixel más próximo de la original); después se
+# agrega ruido sal y pimienta. El tamaño de la imagen no cambia.
+#
+# @param img            página (PackedImage, tinta en 1)
+# @param angle          rotación en grados
+# @param scale          factor de escala
+# @param shift          desplazamiento (dx, dy) en pixels
+# @param noise          fracción de pixels que se fuerzan a tinta o a fondo
+# @param rng            generador de números aleatorios (numpy.random.RandomState)
+def make_variant(img, angle=0., scale=1., shift=(0, 0), noise=0., rng=None):
+    rows, cols = img.shape
+    cx, cy = cols / 2. - 0.5, rows / 2. - 0.5
+
+    # salida -> entrada
+    tform = Affine.translation(-cx - shift[0], -cy - shift[1]) \
+        .then(Affine.scaling(1. / scale)) \
+        .then(Affine.rotation(angle)) \
+        .then(Affine.translation(cx, cy))
+    out = warp_nearest(img, tform, img.shape)
+
+    if noise > 0:
+        if rng is None:
+            rng = np.random.RandomState()
+        flip = rng.random_sample(out.shape)
+        out[flip < noise / 2] = True
+        out[(flip >= noise / 2) & (flip < noise)] = False
+    return PackedImage.from_array(out)
+
+## Parámetros (reproducibles) de las variantes sintéticas
+#
+# La primera variante es el telegrama original sin modificar.
+#
+# @param count          cantidad de variantes
+# @param seed           semilla
+def variant_params(count, seed=0):
+    rng = np.random.RandomState(seed)
+    params = []
+    for n in range(count):
+        if n == 0:
+            params.append(OrderedDict([('angle', 0.), ('scale', 1.), ('shift', [0, 0]), ('noise', 0.)]))
+            continue
+        params.append(OrderedDict([
+            ('angle', rng.uniform(-max_rotation, max_rotation)),
+            ('scale', 1. + rng.uniform(-max_scale_jitter, max_scale_jitter)),
+            ('shift', [int(v) for v in rng.randint(-max_shift, max_shift + 1, size=2)]),
+            ('noise', rng.uniform(0, max_noise)),
+        ]))
+    return params
+
+## Escribe las variantes sintéticas como .pbm y devuelve sus paths
+#
+# @param sample_file    telegrama original
+# @param out_dir        directorio de salida
+# @param params         parámetros de cada variante (ver variant_params)
+# @param seed           semilla del ruido
+def generate_variants(sample_file, out_dir, params, seed=0):
+    img = telegrama.load_image(sample_file, packed=True)
+    rng = np.random.RandomState(seed)
+    files = []
+    for n, p in enumerate(params):
+        variant = make_variant(img, p['angle'], p['scale'], p['shift'], p['noise'], rng)
+        files.append(write_image(variant, os.path.join(out_dir, 'variant-%03d' % n)))
+    return files
+
+## Inicialización de cada proceso del pool
+#
+# @param warmup         telegrama a procesar antes de medir (ver _run), para
+#                       que cada proceso ya tenga cargadas librerías y template
+# @param ready          contador compartido (multiprocessing.Value) de los
+#                       procesos que ya terminaron de inicializarse
+def _init_worker(warmup=None, ready=None):
+    # el proceso principal se encarga de Ctrl-C; la salida de cada
+    # telegrama no interesa
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        if warmup is not None:
+            image_file, out_base = warmup
+            _run((image_file, '%s-%d' % (out_base, os.getpid())))
+    finally:
+        if ready is not None:
+            with ready.get_lock():
+                ready.value += 1
+
+## Procesa un telegrama del benchmark y devuelve su traza
+#
+# @param job            (path de la imagen, prefijo de salida)
+def _run(job):
+    image_file, out_base = job
+    tracer = tracing.Tracer(os.path.basename(image_file))
+    telegrama.process_telegram(image_file, out_base, tracer=tracer)
+    return tracer.record()
+
+## Latencia por etapa y de punta a punta, procesando de a un telegrama
+#
+# Devuelve las trazas de cada telegrama (ver tracing.py). Antes de medir se
+# procesa un telegrama para cargar librerías y el template.
+#
+# @param files          imágenes a procesar
+# @param out_dir        directorio para las salidas
+# @param repeat         cantidad de pasadas por el conjunto
+def measure_latency(files, out_dir, repeat=1):
+    stdout, sys.stdout = sys.stdout, open(os.devnull, 'w')
+    try:
+        _run((files[0], os.path.join(out_dir, 'warmup')))
+        records = []
+        for r in range(repeat):
+            for n, image_file in enumerate(files):
+                records.append(_run((image_file, os.path.join(out_dir, 'latency-%03d' % n))))
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return records
+
+## Throughput con una cantidad de procesos dada
+#
+# Se procesan al menos `per_worker` telegramas por proceso (recorriendo las
+# variantes las veces que haga falta), de modo que ningún proceso quede
+# ocioso. Cada proceso procesa un telegrama al arrancar, antes de medir.
+# Devuelve (telegramas por segundo, pico de memoria por proceso en MB).
+#
+# @param files          imágenes a procesar
+# @param out_dir        directorio para las salidas
+# @param workers        cantidad de procesos
+# @param repeat         cantidad de pasadas por el conjunto
+# @param per_worker     cantidad mínima de telegramas por proceso
+def measure_throughput(files, out_dir, workers, repeat=1, per_worker=4):
+    count = max(len(files) * repeat, per_worker * workers)
+    jobs = [(files[n % len(files)], os.path.join(out_dir, 'w%d-%03d' % (workers, n)))
+            for n in range(count)]
+
+    warmup = (files[0], os.path.join(out_dir, 'w%d-warmup' % workers))
+    ready = multiprocessing.Value('i', 0)
+    pool = multiprocessing.Pool(workers, _init_worker, (warmup, ready))
+    try:
+        # se mide recién cuando todos los procesos están listos
+        while ready.value < workers:
+            time.sleep(0.05)
+        start = time.time()
+        records = pool.map(_run, jobs, chunksize=1)
+        elapsed = time.time() - start
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    peak = max([record['peak_rss_mb'] or 0. for record in records] or [0.])
+    return len(jobs) / elapsed, peak
+
+## Corre el benchmark completo
+#
+# Devuelve un diccionario con los parámetros de las variantes, el resumen
+# por etapa (tracing.summarize), el throughput por cantidad de procesos y el
+# pico de memoria.
+#
+# @param sample_file    telegrama original
+# @param count          cantidad de variantes
+# @param workers        lista de cantidades de procesos a medir
+# @param repeat         cantidad de pasadas por el conjunto
+# @param seed           semilla
+# @param work_dir       directorio de trabajo (por defecto uno temporal, que se borra)
+def run_bench(sample_file=SAMPLE_FILE, count=8, workers=(1,), repeat=1, seed=0, work_dir=None):
+    tmp_dir = work_dir is None
+    if tmp_dir:
+        work_dir = tempfile.mkdtemp(prefix='recon-bench-')
+    elif not os.path.isdir(work_dir):
+        os.makedirs(work_dir)
+
+    try:
+        params = variant_params(count, seed)
+        print 'generando %d variantes en %s' % (count, work_dir)
+        files = generate_variants(sample_file, work_dir, params, seed)
+
+        # compila el template antes de crear los workers: lo heredan ya cargado
+        registry.get_template(telegrama.model_file, telegrama.keyword_file)
+
+        print 'latencia por etapa (%d telegramas)' % (count * repeat)
+        records = measure_latency(files, work_dir, repeat)
+        summary = tracing.summarize(records)
+
+        throughput = OrderedDict()
+        peak_rss = summary['total']['peak_rss_mb']
+        for w in workers:
+            tps, peak = measure_throughput(files, work_dir, w, repeat)
+            print '  %2d procesos: %6.2f telegramas/s, %.1f MB por proceso' % (w, tps, peak)
+            throughput[str(w)] = tps
+            peak_rss = max(peak_rss, peak)
+    finally:
+        if tmp_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    return OrderedDict([
+        ('version', BASELINE_VERSION),
+        ('time', time.time()),
+        ('seed', seed),
+        ('variants', params),
+        ('stages', summary),
+        ('throughput', throughput),
+        ('peak_rss_mb', peak_rss),
+    ])
+
+## Compara un resultado con la referencia
+#
+# Una etapa regresiona si su p50 supera al de la referencia en más de
+# `threshold` (fracción) y en más de `min_delta` segundos (para no reaccionar
+# a etapas de pocos milisegundos); el throughput regresiona si cae en más de
+# `threshold`. Devuelve la lista de regresiones (textos).
+#
+# @param result         resultado de run_bench
+# @param baseline       resultado de referencia
+# @param threshold      tolerancia relativa
+# @param min_delta      tolerancia absoluta por etapa, en segundos
+def compare(result, baseline, threshold=0.2, min_delta=0.005):
+    if baseline.get('version') != BASELINE_VERSION:
+        raise ValueError('versión de referencia no soportada: %s' % baseline.get('version'))
+
+    regressions = []
+    print '%-14s %9s %9s %8s' % ('etapa', 'ref[ms]', 'p50[ms]', 'cambio')
+    for name, stats in result['stages'].items():
+        ref = baseline['stages'].get(name)
+        if ref is None:
+            continue
+        change = stats['p50'] / ref['p50'] - 1 if ref['p50'] > 0 else 0.
+        slower = change > threshold and stats['p50'] - ref['p50'] > min_delta
+        print '%-14s %9.1f %9.1f %+7.1f%%%s' % (name, 1000 * ref['p50'], 1000 * stats['p50'],
+                                               100 * change, '  REGRESION' if slower else '')
+        if slower:
+            regressions.append('%s: p50 %.1f ms -> %.1f ms (%+.1f%%)' % (
+                name, 1000 * ref['p50'], 1000 * stats['p50'], 100 * change))
+
+    for w, tps in result['throughput'].items():
+        ref = baseline['throughput'].get(w)
+        if ref is None:
+            continue
+        change = tps / ref - 1
+        slower = change < -threshold
+        print '%2s procesos    %9.2f %9.2f %+7.1f%%%s' % (w, ref, tps, 100 * change,
+                                                     '  REGRESION' if slower else '')
+        if slower:
+            regressions.append('throughput con %s procesos: %.2f -> %.2f telegramas/s (%+.1f%%)'
+                               % (w, ref, tps, 100 * change))
+    return regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark del procesamiento de telegramas")
+    parser.add_argument("-n", "--variants", type=int, default=8,
+                        help="cantidad de variantes sintéticas (por defecto 8)")
+    parser.add_argument("-j", "--workers", type=int, default=multiprocessing.cpu_count(),
+                        help="medir el throughput con 1..N procesos (por defecto uno por core)")
+    parser.add_argument("-r", "--repeat", type=int, default=1,
+                        help="pasadas por el conjunto de variantes")
+    parser.add_argument("--seed", type=int, default=0, help="semilla de las variantes")
+    parser.add_argument("--sample", default=SAMPLE_FILE, help="telegrama de partida")
+    parser.add_argument("--baseline", default=BASELINE_FILE,
+                        help="resultado de referencia (por defecto %(default)s)")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="guardar este resultado como referencia en lugar de compararlo")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="tolerancia relativa antes de considerar una regresión (por defecto 0.2)")
+    parser.add_argument("--output", default=None, help="guardar el resultado (JSON)")
+    parser.add_argument("--work-dir", default=None,
+                        help="conservar las variantes y salidas en este directorio")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    workers = range(1, max(args.workers, 1) + 1)
+    result = run_bench(args.sample, args.variants, workers, args.repeat, args.seed, args.work_dir)
+    print
+    tracing.print_summary(result['stages'])
+    print
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, default=tracing.to_builtin)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(result, f, indent=2, default=tracing.to_builtin)
+        print 'referencia guardada en', args.baseline
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print 'no hay referencia (%s): guardarla con --save-baseline' % args.baseline
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(result, baseline, args.threshold)
+    if regressions:
+        print >>sys.stderr, 'regresiones:'
+        for text in regressions:
+            print >>sys.stderr, '  ' + text
+        return 1
+    print 'sin regresiones'
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+
+## Imágenes binarias empaquetadas (8 pixels por byte)
+#
+# Las páginas de los telegramas son binarias y de ~2500x1900 pixels: como
+# array bool ocupan un byte por pixel. PackedImage guarda cada fila con
+# np.packbits (el bit más significativo de cada byte es el pixel de más a la
+# izquierda, igual que el formato PBM) y resuelve sobre los bytes las
+# operaciones que necesita el procesamiento: inversión, conteos por fila y
+# columna, recortes, reducción 2x y dilatación/erosión con elementos
+# estructurantes rectangulares. Los bits de relleno al final de cada fila se
+# mantienen siempre en cero.
+
+import numpy as np
+
+# cantidad de bits en 1 de cada byte
+_POPCOUNT = np.array([bin(n).count('1') for n in range(256)], dtype='uint8')
+
+# OR de cada par de bits de un byte, compactado en 4 bits (reducción 2x)
+_PAIRS_OR = np.array([sum(((n >> (2*k)) & 3 != 0) << k for k in range(4)) for n in range(256)],
+                     dtype='uint8')
+
+class PackedImage(object):
+
+    ## @param data       array (filas, ceil(columnas/8)) de uint8 con las filas empaquetadas
+    #  @param shape      tamaño (filas, columnas) de la imagen
+    def __init__(self, data, shape):
+        self.data = data
+        self.shape = (int(shape[0]), int(shape[1]))
+
+    ## Empaqueta una imagen binaria
+    #
+    # @param img        array 2D (todo valor distinto de cero es 1)
+    @classmethod
+    def from_array(cls, img):
+        return cls(np.packbits(np.asarray(img) != 0, axis=1), img.shape)
+
+    ## Binariza (Otsu) y empaqueta una imagen en escala de grises
+    #
+    # @param img        array 2D en escala de grises (o binario)
+    @classmethod
+    def from_gray(cls, img):
+        if img.dtype != 'bool':
+            from skimage import filter
+            img = img > filter.threshold_otsu(img)
+        return cls.from_array(img)
+
+    @property
+    def size(self):
+        return self.shape[0] * self.shape[1]
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes
+
+    ## Máscara de los bits válidos del último byte de cada fila
+    def _tail_mask(self):
+        nbits = self.shape[1] % 8
+        return 0xFF if nbits == 0 else (0xFF << (8 - nbits)) & 0xFF
+
+    ## Pone en cero los bits de relleno (in-place)
+    def _clear_padding(self, data):
+        if data.shape[1] > 0:
+            data[:, -1] &= self._tail_mask()
+        return data
+
+    ## Imagen desempaquetada (array bool)
+    def unpack(self):
+        bits = np.unpackbits(self.data, axis=1)[:, :self.shape[1]]
+        return bits.view('bool')
+
+    ## Imagen invertida
+    def invert(self):
+        return PackedImage(self._clear_padding(np.invert(self.data)), self.shape)
+
+    ## Cantidad de pixels en 1
+    def sum(self):
+        return int(_POPCOUNT[self.data].sum(dtype='int64'))
+
+    ## Cantidad de pixels en 1 de cada fila
+    def row_sums(self):
+        return _POPCOUNT[self.data].sum(axis=1, dtype='int64')
+
+    ## Cantidad de pixels en 1 de cada columna
+    def col_sums(self):
+        sums = np.empty((self.data.shape[1], 8), dtype='int64')
+        for bit in range(8):
+            sums[:, bit] = ((self.data >> (7 - bit)) & 1).sum(axis=0, dtype='int64')
+        return sums.ravel()[:self.shape[1]]
+
+    ## Recorte de una región, desempaquetado
+    #
+    # Sólo se desempaquetan los bytes que cubren la región. La parte de la
+    # región fuera de la imagen se rellena con `fill`.
+    #
+    # @param x, y       esquina superior izquierda de la región
+    # @param w, h       ancho y alto de la región
+    # @param fill       valor para los pixels fuera de la imagen
+    def crop(self, x, y, w, h, fill=False):
+        x, y = int(x), int(y)
+        w, h = max(int(w), 0), max(int(h), 0)
+        rows, cols = self.shape
+
+        x1, y1 = min(max(x, 0), cols), min(max(y, 0), rows)
+        x2, y2 = max(min(x + w, cols), x1), max(min(y + h, rows), y1)
+
+        b1, b2 = x1 // 8, (x2 + 7) // 8
+        bits = np.unpackbits(self.data[y1:y2, b1:b2], axis=1)
+        inside = bits[:, x1 - 8*b1:x2 - 8*b1].view('bool')
+        if (x1, y1, x2, y2) == (x, y, x + w, y + h):
+            return inside
+
+        subimg = np.empty((h, w), dtype='bool')
+        subimg.fill(fill)
+        subimg[y1-y:y2-y, x1-x:x2-x] = inside
+        return subimg
+
+    ## Valores de pixels sueltos (array bool con la forma de `rows`)
+    #
+    # @param rows, cols arrays de índices, dentro de la imagen
+    def take(self, rows, cols):
+        cols = np.asarray(cols)
+        values = self.data[rows, cols >> 3] >> (7 - (cols & 7)).astype('uint8')
+        return (values & 1).astype('bool')
+
+    ## Reducción a la mitad (cada pixel es el OR de un bloque de 2x2)
+    #
+    # Para imágenes binarias equivale a transform.rescale(img, 0.5) > 0.
+    def reduce2(self):
+        rows, cols = self.shape
+        out_rows, out_cols = (rows + 1) // 2, (cols + 1) // 2
+
+        # OR de pares de filas
+        data = self.data
+        if rows % 2:
+            data = np.vstack([data, np.zeros((1, data.shape[1]), dtype='uint8')])
+        data = data[0::2] | data[1::2]
+
+        # OR de pares de columnas: cada byte da 4 bits de la salida
+        if data.shape[1] % 2:
+            data = np.hstack([data, np.zeros((data.shape[0], 1), dtype='uint8')])
+        halves = _PAIRS_OR[data]
+        packed = (halves[:, 0::2] << 4) | halves[:, 1::2]
+        packed = packed[:, :(out_cols + 7) // 8]
+
+        out = PackedImage(np.ascontiguousarray(packed), (out_rows, out_cols))
+        out._clear_padding(out.data)
+        return out
+
+    ## Desplazamiento horizontal de `n` pixels: out[:, x] = img[:, x + n]
+    #
+    # Los bits que entran por el borde toman el valor `fill`.
+    def _shift_cols(self, data, n, fill):
+        out = data
+        step = 1 if n > 0 else -1
+        for k in range(abs(n)):
+            if step > 0:
+                # los bits se mueven hacia la izquierda (más significativos)
+                carry = np.zeros_like(out)
+                carry[:, :-1] = out[:, 1:] >> 7
+                out = ((out << 1) & 0xFF) | carry
+                if fill:
+                    # el relleno entra por la última columna válida
+                    self._set_last_col(out)
+            else:
+                carry = np.zeros_like(out)
+                carry[:, 1:] = (out[:, :-1] & 1) << 7
+                if fill:
+                    carry[:, 0] = 0x80
+                out = (out >> 1) | carry
+            out = self._clear_padding(out)
+        return out
+
+    ## Pone en 1 la última columna válida (in-place)
+    def _set_last_col(self, data):
+        col = self.shape[1] - 1
+        data[:, col // 8] |= 0x80 >> (col % 8)
+
+    ## Desplazamiento vertical de `n` pixels: out[y] = img[y + n]
+    def _shift_rows(self, data, n, fill):
+        if n == 0:
+            return data
+        out = np.empty_like(data)
+        out.fill(0xFF if fill else 0)
+        if n > 0:
+            out[:-n] = data[n:]
+        else:
+            out[-n:] = data[:n]
+        return self._clear_padding(out)
+
+    ## Combina desplazamientos de la imagen sobre una ventana rectangular
+    def _rect_filter(self, height, width, erode):
+        # misma ventana que ndimage.convolve con un elemento de height x width
+        # (el centro de un elemento de tamaño par queda a la derecha/abajo)
+        dys = range(-((height - 1) // 2), height // 2 + 1)
+        dxs = range(-((width - 1) // 2), width // 2 + 1)
+        combine = np.bitwise_and if erode else np.bitwise_or
+
+        rows = None
+        for dx in dxs:
+            shifted = self._shift_cols(self.data, dx, erode)
+            rows = shifted if rows is None else combine(rows, shifted)
+        out = None
+        for dy in dys:
+            shifted = self._shift_rows(rows, dy, erode)
+            out = shifted if out is None else combine(out, shifted)
+        return PackedImage(self._clear_padding(out), self.shape)
+
+    ## Dilatación con un elemento estructurante rectangular
+    #
+    # Equivale a morphology.binary_dilation(img, np.ones((height, width))).
+    #
+    # @param height, width  tamaño del elemento (width=None: cuadrado)
+    def dilate(self, height, width=None):
+        return self._rect_filter(height, height if width is None else width, False)
+
+    ## Erosión con un elemento estructurante rectangular
+    #
+    # Equivale a morphology.binary_erosion(img, np.ones((height, width))).
+    #
+    # @param height, width  tamaño del elemento (width=None: cuadrado)
+    def erode(self, height, width=None):
+        return self._rect_filter(height, height if width is None else width, True)
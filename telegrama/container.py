@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Contenedor de los recortes de un telegrama
+#
+# En lugar de un JPEG por tabla, celda, celda limpia y dígito, todos los
+# recortes de un telegrama se guardan en un único archivo (-CROPS.npz): un
+# zip con un miembro por recorte (la imagen binaria empaquetada a 8 pixels
+# por byte) y un índice JSON con el tamaño de cada recorte, su orden y los
+# resultados de la detección; además, si se indican, los dígitos
+# normalizados para el clasificador (un único array (N, 784)). Al abrirlo
+# sólo se lee el directorio del zip; cada recorte se descomprime recién
+# cuando se lo pide.
+#
+# Listar el contenido o exportarlo a los JPEG de siempre:
+#
+#   $ python telegrama/container.py telegrama-CROPS.npz [--jpeg]
+
+import os, sys
+import argparse
+import json
+
+import numpy as np
+
+from bitimage import PackedImage
+from tracing import to_builtin
+
+CONTAINER_VERSION = 1
+CONTAINER_SUFFIX = '-CROPS.npz'
+INDEX_KEY = '__index__'
+SAMPLES_KEY = '__samples__'
+
+## Guarda los recortes de un telegrama en un contenedor
+#
+# @param path           path del contenedor
+# @param crops          diccionario ordenado nombre -> imagen binaria (ver extract_crops)
+# @param detections     resultados de la detección (ver process_telegram)
+# @param samples        par (array (N, 784) uint8, nombres de los recortes),
+#                       ver digits.digit_samples
+def save_container(path, crops, detections=None, samples=None):
+    arrays, shapes = {}, []
+    for name, subimg in crops.items():
+        packed = subimg if isinstance(subimg, PackedImage) else PackedImage.from_array(subimg)
+        arrays[name] = packed.data
+        shapes.append([name, packed.shape[0], packed.shape[1]])
+
+    index = {'version': CONTAINER_VERSION, 'crops': shapes, 'detections': detections}
+    if samples is not None:
+        arrays[SAMPLES_KEY] = np.asarray(samples[0], dtype='uint8')
+        index['samples'] = list(samples[1])
+    arrays[INDEX_KEY] = np.array(json.dumps(index, default=to_builtin))
+
+    # escritura atómica, como el cache de templates
+    tmp_file = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_file, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    os.rename(tmp_file, path)
+
+## Contenedor abierto para lectura
+#
+# Se accede a los recortes por nombre ('CELDA_3', 'CELDA_3-0', 'CELDA_3-2',
+# 'TABLA_1', ...):
+#
+#   with TelegramContainer(path) as crops:
+#       cell = crops['CELDA_3']              # array bool
+#       packed = crops.packed('CELDA_3')     # PackedImage
+class TelegramContainer(object):
+
+    ## @param path       path del contenedor
+    def __init__(self, path):
+        self.path = path
+        self._npz = np.load(path)
+        index = json.loads(str(self._npz[INDEX_KEY]))
+        if index['version'] != CONTAINER_VERSION:
+            raise ValueError('versión de contenedor no soportada: %s' % index['version'])
+        self.detections = index['detections']
+        self._shapes = dict((name, (h, w)) for name, h, w in index['crops'])
+        self._names = [name for name, h, w in index['crops']]
+        self._sample_names = index.get('samples')
+
+    ## Nombres de los recortes, en el orden en que se guardaron
+    def names(self):
+        return list(self._names)
+
+    def __contains__(self, name):
+        return name in self._shapes
+
+    ## Tamaño (alto, ancho) de un recorte
+    def shape(self, name):
+        return self._shapes[name]
+
+    def __len__(self):
+        return len(self._names)
+
+    def __iter__(self):
+        return iter(self._names)
+
+    ## Recorte empaquetado (sólo se lee ese miembro del archivo)
+    def packed(self, name):
+        return PackedImage(self._npz[name], self._shapes[name])
+
+    ## Recorte como array bool
+    def __getitem__(self, name):
+        return self.packed(name).unpack()
+
+    ## Todos los recortes, como lista de pares (nombre, array bool)
+    def items(self):
+        return [(name, self[name]) for name in self._names]
+
+    ## Dígitos normalizados: (array (N, 784) uint8, nombres de los recortes)
+    #
+    # El array se puede pasar tal cual a BaseDigitClassifier.batch_classify.
+    def samples(self):
+        if self._sample_names is None:
+            return None
+        return self._npz[SAMPLES_KEY], list(self._sample_names)
+
+    def close(self):
+        self._npz.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+## Exporta los recortes de un contenedor a los JPEG de siempre
+#
+# Genera los mismos archivos que telegrama.save_crops. Devuelve sus paths.
+#
+# @param path           path del contenedor
+# @param base_name      prefijo de los archivos (por defecto el del contenedor)
+# @param names          recortes a exportar (por defecto todos)
+def export_jpegs(path, base_name=None, names=None):
+    from skimage import io
+
+    if base_name is None:
+        base_name = path[:-len(CONTAINER_SUFFIX)] if path.endswith(CONTAINER_SUFFIX) else os.path.splitext(path)[0]
+    out_files = []
+    with TelegramContainer(path) as crops:
+        for name in (crops.names() if names is None else names):
+            out_file = base_name + '-' + name + '.jpg'
+            io.imsave(out_file, crops[name].astype('float64'))
+            out_files.append(out_file)
+    return out_files
+
+def main():
+    parser = argparse.ArgumentParser(description="Contenido de un contenedor de recortes")
+    parser.add_argument("container", help="archivo " + CONTAINER_SUFFIX)
+    parser.add_argument("names", nargs='*', help="recortes a mostrar/exportar (por defecto todos)")
+    parser.add_argument("--jpeg", action="store_true",
+                        help="exportar los recortes como JPEG (formato anterior)")
+    args = parser.parse_args()
+
+    if args.jpeg:
+        for out_file in export_jpegs(args.container, names=args.names or None):
+            print out_file
+        return 0
+
+    with TelegramContainer(args.container) as crops:
+        for name in args.names or crops.names():
+            h, w = crops.shape(name)
+            print '%-16s %5d x %-5d %6d px' % (name, w, h, crops.packed(name).sum())
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+
+import numpy as np
+
+from bitimage import PackedImage
+
+## Recorte de una región rectangular de la imagen
+#
+# Si la región cae completamente dentro de la imagen devuelve una vista de
+# numpy (no copia pixels). Sólo cuando la región se sale de la página arma
+# un array nuevo, rellenando con `fill` la parte que queda afuera. Sobre un
+# PackedImage sólo se desempaqueta la región pedida.
+#
+# @param img            imagen (array o PackedImage)
+# @param x, y           esquina superior izquierda de la región
+# @param w, h           ancho y alto de la región
+# @param fill           valor para los pixels fuera de la imagen
+def crop(img, x, y, w, h, fill=0):
+    if isinstance(img, PackedImage):
+        return img.crop(x, y, w, h, bool(fill))
+
+    x, y = int(x), int(y)
+    w, h = max(int(w), 0), max(int(h), 0)
+    rows, cols = img.shape[0], img.shape[1]
+
+    # región recortada a los bordes de la imagen
+    x1, y1 = min(max(x, 0), cols), min(max(y, 0), rows)
+    x2, y2 = max(min(x + w, cols), x1), max(min(y + h, rows), y1)
+
+    if (x1, y1, x2, y2) == (x, y, x + w, y + h):
+        return img[y1:y2, x1:x2]
+
+    subimg = np.empty((h, w) + img.shape[2:], dtype=img.dtype)
+    subimg.fill(fill)
+    subimg[y1-y:y2-y, x1-x:x2-x] = img[y1:y2, x1:x2]
+    return subimg
+
+## Recorte a partir de un bounding-box con extremos inclusivos
+#
+# @param img            imagen
+# @param bb             [x0, y0, x1, y1] (como los devuelve segment_digits)
+# @param fill           valor para los pixels fuera de la imagen
+def crop_box(img, bb, fill=0):
+    return crop(img, bb[0], bb[1], bb[2]-bb[0]+1, bb[3]-bb[1]+1, fill)
+
+## Recorte de tablas/celdas del modelo
+#
+# Devuelve un diccionario ordenado id -> recorte (vistas de `img` siempre
+# que sea posible).
+#
+# @param img            imagen sobre la que se recorta
+# @param fields         lista de [x, y, w, h, id] en coordenadas de procesamiento
+# @param scale          escala de procesamiento (las coordenadas se dividen por ella)
+# @param fill           valor para los pixels fuera de la imagen
+def crop_fields(img, fields, scale=1.0, fill=0):
+    crops = OrderedDict()
+    for field in fields:
+        x, y, w, h, id = field[0:5]
+        crops[id] = crop(img, x / scale, y / scale, w / scale, h / scale, fill)
+    return crops
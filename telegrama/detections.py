@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+
+## Resultados de la detección de un telegrama (-DETECT.json)
+#
+# Lectura y escritura de los resultados guardados por process_telegram. Es
+# un módulo liviano (sólo json) para que preview.py y otras herramientas
+# puedan leerlos sin importar todo el procesamiento.
+
+import json
+
+from tracing import to_builtin
+
+DETECT_SUFFIX = '-DETECT.json'
+
+## Guarda los resultados de la detección (ver process_telegram)
+#
+# @param base_name       prefijo de los archivos de salida
+# @param detections      diccionario con los resultados
+def save_detections(base_name, detections):
+    with open(base_name + DETECT_SUFFIX, 'w') as f:
+        json.dump(detections, f, default=to_builtin)
+
+## Lee los resultados de la detección guardados por save_detections
+#
+# @param detect_file     path al archivo -DETECT.json
+def load_detections(detect_file):
+    with open(detect_file) as f:
+        return json.load(f)
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+
+## Segmentación de dígitos por componentes conexas
+#
+# segment_digits separa los dígitos de una celda por los huecos del perfil de
+# columnas, suponiendo un único renglón: dos dígitos que se tocan, o que se
+# solapan en x sin tocarse, quedan juntos. Acá cada dígito es una componente
+# conexa de la celda limpia (las partes de un mismo dígito que se solapan en
+# x se unen, y las componentes demasiado anchas se cortan en el mínimo del
+# perfil de columnas), y cada dígito se normaliza al formato que espera
+# digit.BaseDigitClassifier: 28x28 uint8, tinta en 255, sin márgenes.
+
+import numpy as np
+from scipy import ndimage
+from skimage import transform
+
+SAMPLE_SIZE = 28
+
+_CONNECTIVITY = ndimage.generate_binary_structure(2, 2)
+
+## Bounding-box [x0, y0, x1, y1] (extremos inclusivos) de los pixels en True
+def _tight_box(img, x0=0, y0=0):
+    rows, cols = np.flatnonzero(img.any(axis=1)), np.flatnonzero(img.any(axis=0))
+    if len(rows) == 0:
+        return None
+    return [x0 + cols[0], y0 + rows[0], x0 + cols[-1], y0 + rows[-1]]
+
+## Corta (recursivamente) un bounding-box demasiado ancho para ser un dígito
+def _split_wide(img, bb, max_aspect):
+    x0, y0, x1, y1 = bb
+    w, h = x1 - x0 + 1, y1 - y0 + 1
+    margin = int(0.4 * h)
+    if w <= max_aspect * h or margin < 1 or w - 2 * margin < 1:
+        return [bb]
+
+    # corte en la columna con menos tinta, lejos de los bordes
+    profile = img[y0:y1+1, x0+margin:x1+1-margin].sum(axis=0)
+    cut = x0 + margin + int(profile.argmin())
+    boxes = []
+    for a, b in ((x0, cut - 1), (cut, x1)):
+        part = _tight_box(img[y0:y1+1, a:b+1], a, y0) if b >= a else None
+        if part is not None:
+            boxes.extend(_split_wide(img, part, max_aspect))
+    return boxes
+
+## Bounding-boxes de los dígitos de una celda, de izquierda a derecha
+#
+# Devuelve una lista de [x0, y0, x1, y1] (extremos inclusivos), con el mismo
+# formato que segment_digits.
+#
+# @param img            celda limpia (tinta en True), ver process_cell
+# @param min_size       tamaño mínimo (en pixels) de una componente
+# @param min_height     alto mínimo de un dígito, respecto del alto de la celda
+#                       (descarta guiones y restos de líneas)
+# @param min_overlap    solapamiento en x (respecto de la más angosta) a partir
+#                       del cual dos componentes son parte del mismo dígito
+# @param max_aspect     relación ancho/alto a partir de la cual se corta
+def segment_components(img, min_size=32, min_height=0.25, min_overlap=0.5, max_aspect=1.5):
+    img = np.asarray(img) > 0
+    labels, n = ndimage.label(img, _CONNECTIVITY)
+    if n == 0:
+        return []
+    sizes = np.bincount(labels.ravel())
+
+    boxes = []
+    for k, (rows, cols) in enumerate(ndimage.find_objects(labels)):
+        if sizes[k + 1] >= min_size:
+            boxes.append([cols.start, rows.start, cols.stop - 1, rows.stop - 1])
+    boxes.sort()
+
+    # une las componentes solapadas en x (p.ej. un 5 o un 7 cortados)
+    merged = []
+    for bb in boxes:
+        if merged:
+            last = merged[-1]
+            overlap = min(last[2], bb[2]) - max(last[0], bb[0]) + 1
+            narrow = min(last[2] - last[0], bb[2] - bb[0]) + 1
+            if overlap >= min_overlap * narrow:
+                merged[-1] = [min(last[0], bb[0]), min(last[1], bb[1]),
+                              max(last[2], bb[2]), max(last[3], bb[3])]
+                continue
+        merged.append(list(bb))
+
+    # separa dígitos que se tocan
+    digits = []
+    for bb in merged:
+        if bb[3] - bb[1] + 1 >= min_height * img.shape[0]:
+            digits.extend(_split_wide(img, bb, max_aspect))
+    return [[int(v) for v in bb] for bb in digits]
+
+## Normaliza un dígito al formato de los clasificadores (MNIST)
+#
+# El dígito se recorta a su bounding-box, se escala para que su lado mayor
+# ocupe los 28 pixels (manteniendo la relación de aspecto) y se centra.
+# Devuelve un array (784,) de uint8 con la tinta en 255.
+#
+# @param img            imagen del dígito (tinta en True)
+def normalize_digit(img):
+    img = np.asarray(img) > 0
+    sample = np.zeros((SAMPLE_SIZE, SAMPLE_SIZE), dtype='uint8')
+    bb = _tight_box(img)
+    if bb is None:
+        return sample.ravel()
+
+    img = img[bb[1]:bb[3]+1, bb[0]:bb[2]+1]
+    h, w = img.shape
+    scale = float(SAMPLE_SIZE) / max(h, w)
+    out_h = min(max(int(round(h * scale)), 1), SAMPLE_SIZE)
+    out_w = min(max(int(round(w * scale)), 1), SAMPLE_SIZE)
+    resized = transform.resize(img.astype('float64'), (out_h, out_w), order=1)
+
+    y, x = (SAMPLE_SIZE - out_h) // 2, (SAMPLE_SIZE - out_w) // 2
+    sample[y:y+out_h, x:x+out_w] = np.round(np.clip(resized, 0, 1) * 255).astype('uint8')
+    return sample.ravel()
+
+## Muestras de todos los dígitos recortados de un telegrama
+#
+# Devuelve (samples, names): un array (N, 784) de uint8 listo para
+# BaseDigitClassifier.batch_classify y los nombres de los recortes
+# correspondientes ('CELDA_n-k').
+#
+# @param crops          recortes devueltos por extract_crops (fondo en True)
+def digit_samples(crops):
+    names = []
+    for name in crops:
+        cell, _, k = name.partition('-')
+        if cell.startswith('CELDA') and k.isdigit() and k != '0':
+            names.append(name)
+    samples = np.zeros((len(names), SAMPLE_SIZE * SAMPLE_SIZE), dtype='uint8')
+    for n, name in enumerate(names):
+        samples[n] = normalize_digit(np.bitwise_not(crops[name]))
+    return samples, names
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+
+## Geometría página <-> modelo
+#
+# La relación entre la página escaneada (imagen original, a resolución
+# completa) y el sistema de coordenadas donde se detectan líneas,
+# cuadriláteros y la palabra clave (la página reducida a la escala de
+# procesamiento y enderezada) es una transformación afín: escala, rotación
+# alrededor del centro y traslación. Con ella se recorta cada tabla y celda
+# directamente de la página original, llevando sólo esa ventana al sistema
+# enderezado. Como el ángulo es chico, la rotación se descompone en tres
+# cortes (shear) de corrimientos enteros por filas o columnas: cada tira de
+# filas (o columnas) con el mismo corrimiento se copia de una vez, sin
+# calcular coordenadas por pixel.
+
+from collections import OrderedDict
+
+import numpy as np
+
+from bitimage import PackedImage
+from crop import crop
+
+## Transformación afín del plano, sobre puntos (x, y)
+class Affine(object):
+
+    ## @param matrix     matriz 3x3 (coordenadas homogéneas); por defecto la identidad
+    def __init__(self, matrix=None):
+        self.matrix = np.eye(3) if matrix is None else np.array(matrix, dtype='float64')
+
+    @classmethod
+    def translation(cls, tx, ty):
+        return cls([[1, 0, tx], [0, 1, ty], [0, 0, 1]])
+
+    @classmethod
+    def scaling(cls, sx, sy=None):
+        return cls([[sx, 0, 0], [0, sx if sy is None else sy, 0], [0, 0, 1]])
+
+    ## Rotación alrededor del origen, con la convención de transform.rotate
+    #
+    # @param angle      ángulo en grados
+    @classmethod
+    def rotation(cls, angle):
+        c, s = np.cos(np.deg2rad(angle)), np.sin(np.deg2rad(angle))
+        return cls([[c, -s, 0], [s, c, 0], [0, 0, 1]])
+
+    ## Composición: primero esta transformación y después `other`
+    def then(self, other):
+        return Affine(np.dot(other.matrix, self.matrix))
+
+    def inverse(self):
+        return Affine(np.linalg.inv(self.matrix))
+
+    ## Aplica la transformación a un array (N, 2) de puntos (x, y)
+    def __call__(self, points):
+        points = np.asarray(points, dtype='float64').reshape(-1, 2)
+        return np.dot(points, self.matrix[:2, :2].T) + self.matrix[:2, 2]
+
+    def tolist(self):
+        return self.matrix.tolist()
+
+## Transformación de enderezado, equivalente a transform.rotate(..., resize=True)
+#
+# Devuelve (tform, shape): `tform` lleva coordenadas de la imagen enderezada
+# a coordenadas de la imagen original y `shape` es el tamaño de la imagen
+# enderezada.
+#
+# @param shape          tamaño (filas, columnas) de la imagen a enderezar
+# @param angle          ángulo de rotación en grados (ver estimate_rotation)
+def rotation_transform(shape, angle):
+    rows, cols = shape[0], shape[1]
+    center = np.array((cols, rows)) / 2. - 0.5
+    tform = Affine.translation(-center[0], -center[1]) \
+        .then(Affine.rotation(angle)) \
+        .then(Affine.translation(center[0], center[1]))
+
+    # tamaño de la imagen enderezada: debe contener a la página entera
+    corners = tform(np.array([[0, 0], [0, rows - 1], [cols - 1, rows - 1], [cols - 1, 0]]))
+    out_cols = corners[:, 0].max() - corners[:, 0].min() + 1
+    out_rows = corners[:, 1].max() - corners[:, 1].min() + 1
+    out_shape = (int(np.ceil(out_rows)), int(np.ceil(out_cols)))
+
+    tform = Affine.translation((cols - out_cols) / 2., (rows - out_rows) / 2.).then(tform)
+    return tform, out_shape
+
+## Valores de `img` en los pixels (y, x); `fill` fuera de la imagen
+def _gather(img, y, x, fill):
+    values = np.empty(x.shape, dtype='bool')
+    values.fill(fill)
+    valid = (x >= 0) & (x < img.shape[1]) & (y >= 0) & (y < img.shape[0])
+    if isinstance(img, PackedImage):
+        values[valid] = img.take(y[valid], x[valid])
+    else:
+        values[valid] = img[y[valid], x[valid]] != 0
+    return values
+
+## Remuestreo de una imagen binaria
+#
+# Cada pixel (x, y) de la salida toma el valor del pixel de `img` más
+# próximo a tform(x, y); los que caen fuera de `img` toman el valor `fill`.
+# Con `any_neighbour=True` el pixel de salida es el OR de los pixels de
+# entrada que rodean a tform(x, y), lo que equivale a interpolar en forma
+# bilineal y umbralizar en > 0 (como transform.rotate(img, ...) > 0).
+# Se procesa por bloques de filas para no armar la grilla completa de
+# coordenadas.
+#
+# @param img            imagen binaria (array o PackedImage)
+# @param tform          transformación salida -> entrada (Affine)
+# @param shape          tamaño (filas, columnas) de la salida
+# @param fill           valor para los pixels fuera de la imagen
+# @param any_neighbour  OR de los vecinos en lugar del más próximo
+# @param block          cantidad de filas por bloque
+def warp_nearest(img, tform, shape, fill=False, any_neighbour=False, block=256):
+    rows, cols = int(shape[0]), int(shape[1])
+    out = np.empty((rows, cols), dtype='bool')
+
+    (a, b, c), (d, e, f) = tform.matrix[0], tform.matrix[1]
+    u = np.arange(cols, dtype='float64')
+    for start in range(0, rows, block):
+        v = np.arange(start, min(start + block, rows), dtype='float64')[:, np.newaxis]
+        x = a * u + b * v + c
+        y = d * u + e * v + f
+        dst = out[start:start + len(v)]
+        if not any_neighbour:
+            dst[:] = _gather(img, np.round(y).astype('intp'), np.round(x).astype('intp'), fill)
+            continue
+
+        # vecinos con peso no nulo en la interpolación bilineal
+        x0, y0 = np.floor(x), np.floor(y)
+        dx, dy = x > x0, y > y0
+        x0, y0 = x0.astype('intp'), y0.astype('intp')
+        dst[:] = _gather(img, y0, x0, fill)
+        dst |= dx & _gather(img, y0, x0 + 1, fill)
+        dst |= dy & _gather(img, y0 + 1, x0, fill)
+        dst |= dx & dy & _gather(img, y0 + 1, x0 + 1, fill)
+    return out
+
+## Redondeo al entero más próximo (como warp_nearest), a array de índices
+def _round(values):
+    return np.floor(np.asarray(values, dtype='float64') + 0.5).astype('intp')
+
+## Corrimiento entero de cada fila
+#
+# out[r, c] = img[r + dy, c + shifts[r]] para c < width; fuera de `img`,
+# `fill`. Las filas consecutivas con el mismo corrimiento se copian juntas.
+#
+# @param img            imagen binaria (array o PackedImage)
+# @param shifts         corrimiento horizontal de cada fila de la salida
+# @param width          ancho de la salida
+# @param dy             corrimiento vertical (común a todas las filas)
+# @param fill           valor para los pixels fuera de la imagen
+def shift_rows(img, shifts, width, dy=0, fill=False):
+    shifts = np.asarray(shifts, dtype='intp')
+    out = np.empty((len(shifts), max(int(width), 0)), dtype='bool')
+    if len(shifts) == 0:
+        return out
+    starts = np.flatnonzero(np.r_[True, shifts[1:] != shifts[:-1]])
+    stops = np.r_[starts[1:], len(shifts)]
+    for r0, r1 in zip(starts.tolist(), stops.tolist()):
+        out[r0:r1] = crop(img, shifts[r0], r0 + dy, width, r1 - r0, fill)
+    return out
+
+## Corrimiento entero de cada columna: out[r, c] = img[r + shifts[c], c + dx]
+#
+# @param img            imagen binaria (array)
+# @param shifts         corrimiento vertical de cada columna de la salida
+# @param height         alto de la salida
+# @param dx             corrimiento horizontal (común a todas las columnas)
+# @param fill           valor para los pixels fuera de la imagen
+def shift_cols(img, shifts, height, dx=0, fill=False):
+    return shift_rows(np.asarray(img).T, shifts, height, dx, fill).T
+
+## Ángulo (en radianes) de una transformación que es una rotación más una
+## traslación, o None si tiene escala o deformación
+def _rotation_angle(tform):
+    (a, b), (d, e) = tform.matrix[0, :2], tform.matrix[1, :2]
+    if not np.allclose([a, b], [e, -d]) or not np.isclose(a*a + d*d, 1):
+        return None
+    return np.arctan2(d, a)
+
+## Remuestreo por tres cortes (rotación de Paeth)
+#
+# Equivale a warp_nearest(img, tform, shape, fill) cuando `tform` es una
+# rotación (sin escala) más una traslación: la rotación se escribe como
+# X(k) Y(sin) X(k), con X e Y cortes horizontal y vertical y k = -tan(a/2),
+# y cada corte es un corrimiento entero de filas o de columnas (ver
+# shift_rows). Cada corte redondea por separado, así que un pixel puede
+# quedar a un pixel de distancia del que tomaría warp_nearest. Con otra
+# transformación se usa warp_nearest.
+#
+# Con `any_neighbour=True` se remuestrea medio pixel corrido y con una fila
+# y una columna más, y cada pixel de salida es el OR del bloque de 2x2 que
+# lo rodea (como el OR de los vecinos de warp_nearest).
+#
+# @param img            imagen binaria (array o PackedImage)
+# @param tform          transformación salida -> entrada (Affine)
+# @param shape          tamaño (filas, columnas) de la salida
+# @param fill           valor para los pixels fuera de la imagen
+# @param any_neighbour  OR de los vecinos en lugar del más próximo
+def warp_sheared(img, tform, shape, fill=False, any_neighbour=False):
+    angle = _rotation_angle(tform)
+    if angle is None:
+        return warp_nearest(img, tform, shape, fill, any_neighbour)
+
+    h, w = int(shape[0]), int(shape[1])
+    if any_neighbour:
+        out = warp_sheared(img, Affine.translation(-0.5, -0.5).then(tform), (h + 1, w + 1), fill)
+        return out[:-1, :-1] | out[1:, :-1] | out[:-1, 1:] | out[1:, 1:]
+
+    sin = np.sin(angle)
+    k = -sin / (1 + np.cos(angle))
+    tx, ty = tform.matrix[0, 2], tform.matrix[1, 2]
+
+    # último corte: out[v, u] = I2[v, u + k v]; I2 cubre las columnas x2 + j
+    shift3 = _round(k * np.arange(h))
+    x2 = shift3.min() if h else 0
+    w2 = w + (shift3.max() - x2 if h else 0)
+
+    # corte vertical, con la parte fraccionaria de ty:
+    # I2[y, x] = I1[y + sin x + ty - floor(ty), x]; I1 cubre las filas y1 + i
+    dy = int(np.floor(ty))
+    shift2 = _round(sin * np.arange(x2, x2 + w2) + ty - dy)
+    y1 = shift2.min() if w2 else 0
+    h1 = h + (shift2.max() - y1 if w2 else 0)
+
+    # primer corte, con el resto de la traslación:
+    # I1[y, x] = img[y + floor(ty), x + k y + tx]
+    rows = np.arange(y1, y1 + h1)
+    img1 = shift_rows(img, x2 + _round(k * rows + tx), w2, y1 + dy, fill)
+    img2 = shift_cols(img1, shift2 - y1, h, 0, fill)
+    return shift_rows(img2, shift3 - x2, w, 0, fill)
+
+## Recorte de tablas/celdas desde la página original
+#
+# Los campos están en coordenadas de la imagen enderezada a la escala de
+# procesamiento; cada ventana se lleva a la página original con `tform` y se
+# remuestrea a resolución completa (ver warp_sheared). Devuelve un
+# diccionario ordenado id -> recorte, como crop.crop_fields.
+#
+# @param img            página original (array o PackedImage)
+# @param fields         lista de [x, y, w, h, id] en coordenadas enderezadas
+# @param tform          transformación coordenadas enderezadas -> página (Affine)
+# @param scale          escala de procesamiento
+# @param fill           valor para los pixels fuera de la página
+def warp_fields(img, fields, tform, scale=1.0, fill=False):
+    crops = OrderedDict()
+    for field in fields:
+        x, y, w, h, id = field[0:5]
+        window = Affine.scaling(scale).then(Affine.translation(x, y)).then(tform)
+        shape = (max(int(h / scale), 0), max(int(w / scale), 0))
+        crops[id] = warp_sheared(img, window, shape, fill)
+    return crops
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+## Lectura de los archivos de entrada: imágenes de telegramas y modelos .svg
+#
+# Separado de telegrama.py para que los módulos que lo necesitan (registry,
+# preview) no importen el script principal: cuando telegrama.py corre como
+# __main__, importarlo carga una segunda copia del módulo.
+
+import numpy as np
+from skimage import filter
+from xml.dom import minidom
+from bitimage import PackedImage
+from pbm import is_pbm, read_pbm
+from pdfimage import is_pdf, extract_images
+
+## Lee una imagen para procesar por OCR
+#
+# @param file           path a la imagen
+# @param packed         si es True devuelve un PackedImage (8 pixels por byte)
+#                       en lugar de un array bool
+def load_image(file, packed=False):
+    # TODO: forzar escala de grises
+
+    # lee la imagen; los PBM (P4) ya son binarios y se mapean sin decodificar,
+    # de los PDF se extrae en memoria la primera imagen
+    if is_pbm(file):
+        img = read_pbm(file, packed)
+    elif is_pdf(file):
+        images = extract_images(file)
+        if len(images) == 0:
+            raise ValueError('%s no contiene imágenes' % file)
+        img = images[0]
+        if isinstance(img, PackedImage) and not packed:
+            img = img.unpack()
+        elif not isinstance(img, PackedImage) and img.ndim == 3:
+            img = img.mean(axis=2)
+    else:
+        # skimage.data importa pyplot: el backend se elige antes
+        from preview import use_agg
+        use_agg()
+        from skimage import data
+        img = data.load(file)
+
+    # la binariza en caso de que sea escala de grises
+    if packed and not isinstance(img, PackedImage):
+        img = PackedImage.from_gray(img)
+    elif not packed and not img.dtype == 'bool':
+        thr = filter.threshold_otsu(img)
+        img = img > thr
+
+    #si la proporcion de pixels en blanco es mayor a la mitad, la invierte
+    if img.sum() > 0.5 * img.size:
+        img = img.invert() if packed else np.bitwise_not(img)
+
+    return img
+
+## Lectura de modelo a partir de archivo .svg
+#
+# @param svg_file        modelo
+# @param return_reference si es True, devuelve además el rectángulo [x, y, w, h]
+#                        del patch de referencia en coordenadas de la imagen
+def parse_model(svg_file, return_reference=False):
+    doc = minidom.parse(svg_file)
+    tables = []
+    cells = []
+    x0, y0 = 0., 0.
+    w0, h0 = 0., 0.
+    for rect in doc.getElementsByTagName('rect'):
+        x = float(rect.getAttribute('x'))
+        y = float(rect.getAttribute('y'))
+        width = float(rect.getAttribute('width'))
+        height = float(rect.getAttribute('height'))
+        label = rect.getAttribute('inkscape:label').lstrip()
+        id = rect.getAttribute('id').lstrip()
+        if label=="REFERENCIA":
+            x0, y0 = x, y
+            w0, h0 = width, height
+        elif label.find("TABLA") == 0:
+            tables.append([x, y, width, height, id])
+        elif label.find("CELDA") == 0:
+            cells.append([x, y, width, height, id])
+
+    image = doc.getElementsByTagName('image')
+    image_cx = float(image[0].getAttribute('x'))
+    image_cy = float(image[0].getAttribute('y'))
+
+    x0 = x0 - image_cx
+    y0 = y0 - image_cy
+
+    # refiere todo al patch de referencia
+    for i in range(len(tables)):
+        tables[i][0] = tables[i][0] - image_cx - x0
+        tables[i][1] = tables[i][1] - image_cy - y0
+
+    for i in range(len(cells)):
+        cells[i][0] = cells[i][0] - image_cx - x0
+        cells[i][1] = cells[i][1] - image_cy - y0
+
+    if return_reference:
+        return tables, cells, [x0, y0, w0, h0]
+    return tables, cells
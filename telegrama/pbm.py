@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+## Lectura de imágenes PBM binarias (P4) sin decodificar
+#
+# El raster de un PBM P4 son las filas empaquetadas a 8 pixels por byte, con
+# el bit más significativo a la izquierda y cada fila completada hasta el
+# byte: el mismo formato que np.packbits y que PackedImage. Acá se mapea el
+# archivo a memoria y se usa el raster directamente, sin copiarlo. En PBM el
+# 1 es negro.
+
+import numpy as np
+
+from bitimage import PackedImage
+
+MAGIC = 'P4'
+
+## Lee el encabezado de un PBM P4
+#
+# Devuelve (ancho, alto, offset del raster), o None si no es un P4.
+#
+# @param f              archivo abierto en modo binario
+def read_header(f):
+    if f.read(2) != MAGIC:
+        return None
+
+    fields = []
+    c = f.read(1)
+    while len(fields) < 2:
+        if c == '':
+            raise ValueError('PBM truncado')
+        if c == '#':
+            # comentario hasta el fin de línea
+            while c not in ('\n', '\r', ''):
+                c = f.read(1)
+        elif c.isspace():
+            c = f.read(1)
+        elif c.isdigit():
+            value = ''
+            while c.isdigit():
+                value += c
+                c = f.read(1)
+            fields.append(int(value))
+        else:
+            raise ValueError('encabezado PBM inválido')
+
+    # un único caracter de espacio separa el encabezado del raster
+    if not c.isspace():
+        raise ValueError('encabezado PBM inválido')
+    width, height = fields
+    return width, height, f.tell()
+
+## Verifica si un archivo es un PBM P4
+def is_pbm(path):
+    with open(path, 'rb') as f:
+        return f.read(2) == MAGIC
+
+## Lee un PBM P4
+#
+# Con `packed=True` devuelve un PackedImage cuyo raster es un np.memmap del
+# archivo (sólo lectura). Si los bits de relleno de las filas no están en
+# cero (el formato no lo exige) se hace una copia para limpiarlos. Con
+# `packed=False` devuelve un array bool, desempaquetado directo desde el
+# archivo mapeado.
+#
+# @param path           path al archivo
+# @param packed         PackedImage (True) o array bool (False)
+def read_pbm(path, packed=True):
+    with open(path, 'rb') as f:
+        header = read_header(f)
+    if header is None:
+        raise ValueError('%s no es un PBM P4' % path)
+    width, height, offset = header
+
+    data = np.memmap(path, dtype='uint8', mode='r', offset=offset,
+                     shape=(height, (width + 7) // 8))
+    img = PackedImage(data, (height, width))
+
+    padding = 0xFF >> (width % 8) if width % 8 else 0
+    if padding and (data[:, -1] & padding).any():
+        data = np.array(data)
+        data[:, -1] &= ~padding & 0xFF
+        img = PackedImage(data, img.shape)
+
+    return img if packed else img.unpack()
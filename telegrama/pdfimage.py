@@ -0,0 +1,575 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Extracción de las imágenes de un PDF, sin pdfimages
+#
+# Los telegramas de resultados.gob.ar son PDFs con una única imagen binaria
+# comprimida con CCITT G4. Acá se lee el PDF directamente (un parser mínimo
+# de objetos, sin tabla xref), se ubican los XObject de tipo /Image y se
+# decodifican sus streams:
+#
+#   - FlateDecode (con o sin predictores PNG)
+#   - CCITTFaxDecode con K < 0 (Grupo 4), decodificado en Python
+#   - DCTDecode (JPEG, vía PIL)
+#
+# Las imágenes de 1 bit se devuelven como PackedImage con los mismos bits que
+# guarda el PDF (igual que pdfimages), el resto como arrays uint8. Se pueden
+# pasar directo al procesamiento (loader.load_image acepta PDFs) o
+# grabarse como .pbm/.pgm/.ppm:
+#
+#   $ python telegrama/pdfimage.py telegrama.pdf [prefijo]
+
+import os, sys
+import re
+import zlib
+
+import numpy as np
+
+from bitimage import PackedImage
+
+# ----------------------------------------------------------------------
+# objetos PDF
+
+## Referencia indirecta a un objeto ("n g R")
+class Ref(tuple):
+    pass
+
+## Nombre PDF (/Nombre)
+class Name(str):
+    pass
+
+_WHITESPACE = ' \t\r\n\f\0'
+_TOKEN_END = re.compile(r'[\s()<>\[\]{}/%\0]')
+_OBJ_HEADER = re.compile(r'(\d+)\s+(\d+)\s+obj\b')
+_NUMBER = re.compile(r'[+-]?(\d+\.?\d*|\.\d+)$')
+
+## Saltea espacios y comentarios
+def _skip_space(data, pos):
+    n = len(data)
+    while pos < n:
+        c = data[pos]
+        if c in _WHITESPACE:
+            pos += 1
+        elif c == '%':
+            while pos < n and data[pos] not in '\r\n':
+                pos += 1
+        else:
+            break
+    return pos
+
+## Palabra o número a partir de `pos`
+def _read_token(data, pos):
+    m = _TOKEN_END.search(data, pos)
+    end = m.start() if m else len(data)
+    return data[pos:end], end
+
+## String literal (...) a partir de `pos`; devuelve el contenido sin decodificar escapes
+def _read_literal(data, pos):
+    depth, start = 0, pos
+    while pos < len(data):
+        c = data[pos]
+        if c == '\\':
+            pos += 2
+            continue
+        if c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+            if depth == 0:
+                return data[start+1:pos], pos + 1
+        pos += 1
+    raise ValueError('string sin cerrar')
+
+## Parsea un objeto PDF a partir de `pos`
+#
+# Devuelve (valor, posición siguiente). Los diccionarios se devuelven como
+# dict de nombre -> valor, los arrays como listas y las referencias como Ref.
+def parse_object(data, pos):
+    pos = _skip_space(data, pos)
+    c = data[pos:pos+1]
+    if c == '':
+        raise ValueError('fin de datos inesperado')
+
+    if data.startswith('<<', pos):
+        value, pos = {}, pos + 2
+        while True:
+            pos = _skip_space(data, pos)
+            if data.startswith('>>', pos):
+                return value, pos + 2
+            key, pos = parse_object(data, pos)
+            value[key], pos = parse_object(data, pos)
+    if c == '[':
+        value, pos = [], pos + 1
+        while True:
+            pos = _skip_space(data, pos)
+            if data[pos:pos+1] == ']':
+                return value, pos + 1
+            item, pos = parse_object(data, pos)
+            value.append(item)
+    if c == '/':
+        token, pos = _read_token(data, pos + 1)
+        return Name(re.sub(r'#([0-9A-Fa-f]{2})', lambda m: chr(int(m.group(1), 16)), token)), pos
+    if c == '(':
+        return _read_literal(data, pos)
+    if c == '<':
+        end = data.index('>', pos)
+        hexdata = re.sub(r'\s', '', data[pos+1:end])
+        if len(hexdata) % 2:
+            hexdata += '0'
+        return hexdata.decode('hex'), end + 1
+
+    token, end = _read_token(data, pos)
+    if token == '':
+        raise ValueError('caracter inesperado %r' % c)
+    if not _NUMBER.match(token):
+        return {'true': True, 'false': False, 'null': None}.get(token, token), end
+    if '.' in token:
+        return float(token), end
+
+    # "n g R": referencia indirecta
+    m = re.compile(r'\s+(\d+)\s+R\b').match(data, end)
+    if m:
+        return Ref((int(token), int(m.group(1)))), m.end()
+    return int(token), end
+
+## Objetos de un PDF
+#
+# Recorre el archivo buscando los encabezados "n g obj" (sin usar la tabla
+# xref, que suele estar rota en los PDFs escaneados). Si un objeto aparece
+# más de una vez (actualizaciones incrementales) queda la última versión.
+# También se leen los objetos comprimidos en /ObjStm.
+class PDFDocument(object):
+
+    ## @param data       contenido del PDF
+    def __init__(self, data):
+        if not data.startswith('%PDF'):
+            raise ValueError('no es un PDF')
+        self.data = data
+        # número de objeto -> (valor, offset del stream o None)
+        self.objects = {}
+
+        pos = 0
+        while True:
+            m = _OBJ_HEADER.search(data, pos)
+            if m is None:
+                break
+            try:
+                value, pos = parse_object(data, m.end())
+            except (ValueError, IndexError, KeyError):
+                pos = m.end()
+                continue
+            stream = None
+            p = _skip_space(data, pos)
+            if isinstance(value, dict) and data.startswith('stream', p):
+                # el stream empieza después del fin de línea (\r\n o \n)
+                stream = p + 6
+                if data.startswith('\r\n', stream):
+                    stream += 2
+                elif data[stream:stream+1] in ('\r', '\n'):
+                    stream += 1
+                # se saltea el contenido del stream si se conoce su largo
+                length = value.get('Length')
+                pos = stream
+                if isinstance(length, int) and data.startswith('endstream', _skip_space(data, stream + length)):
+                    pos = stream + length
+            self.objects[int(m.group(1))] = (value, stream)
+
+        for num in sorted(self.objects):
+            value, stream = self.objects[num]
+            if stream is not None and value.get('Type') == 'ObjStm':
+                self._read_object_stream(num)
+
+    ## Valor de un objeto, resolviendo referencias indirectas
+    def resolve(self, value):
+        while isinstance(value, Ref):
+            value = self.objects.get(value[0], (None, None))[0]
+        return value
+
+    ## Datos crudos (sin decodificar) del stream de un objeto
+    def raw_stream(self, num):
+        value, start = self.objects[num]
+        length = self.resolve(value.get('Length'))
+        if not isinstance(length, int) or not self.data.startswith('endstream', _skip_space(self.data, start + length)):
+            # largo indirecto no encontrado o incorrecto: se busca el fin del stream
+            end = self.data.index('endstream', start)
+            length = len(self.data[start:end].rstrip('\r\n'))
+        return self.data[start:start+length]
+
+    ## Objetos comprimidos dentro de un /ObjStm
+    def _read_object_stream(self, num):
+        value = self.objects[num][0]
+        data = decode_stream(self, self.raw_stream(num), value)
+        first, count = self.resolve(value['First']), self.resolve(value['N'])
+        header = data[:first].split()
+        for k in range(count):
+            onum, offset = int(header[2*k]), int(header[2*k+1])
+            if onum not in self.objects:
+                self.objects[onum] = (parse_object(data, first + offset)[0], None)
+
+    ## Números de los objetos que son imágenes, en orden
+    def image_objects(self):
+        return [num for num in sorted(self.objects)
+                if self.objects[num][1] is not None
+                and self.resolve(self.objects[num][0].get('Subtype')) == 'Image']
+
+# ----------------------------------------------------------------------
+# filtros
+
+## Deshace los predictores PNG (Predictor >= 10) de un stream Flate
+def _png_unpredict(data, colors, bpc, columns):
+    bpp = max(colors * bpc // 8, 1)
+    stride = (colors * bpc * columns + 7) // 8
+    rows = np.frombuffer(data, dtype='uint8')
+    rows = rows[:len(rows) // (stride + 1) * (stride + 1)].reshape(-1, stride + 1)
+    out = np.zeros((len(rows), stride), dtype='uint8')
+    prev = np.zeros(stride, dtype='int32')
+    for n in range(len(rows)):
+        kind, line = rows[n, 0], rows[n, 1:].astype('int32')
+        if kind == 1:
+            for i in range(bpp, stride):
+                line[i] = (line[i] + line[i-bpp]) & 0xFF
+        elif kind == 2:
+            line = (line + prev) & 0xFF
+        elif kind == 3:
+            for i in range(stride):
+                left = line[i-bpp] if i >= bpp else 0
+                line[i] = (line[i] + (left + prev[i]) // 2) & 0xFF
+        elif kind == 4:
+            for i in range(stride):
+                a = line[i-bpp] if i >= bpp else 0
+                b, c = prev[i], prev[i-bpp] if i >= bpp else 0
+                p = a + b - c
+                pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+                pred = a if pa <= pb and pa <= pc else (b if pb <= pc else c)
+                line[i] = (line[i] + pred) & 0xFF
+        elif kind != 0:
+            raise ValueError('predictor PNG desconocido: %d' % kind)
+        out[n] = line
+        prev = line
+    return out.tostring()
+
+def _flate_decode(data, params):
+    data = zlib.decompress(data)
+    predictor = params.get('Predictor', 1)
+    if predictor >= 10:
+        data = _png_unpredict(data, params.get('Colors', 1), params.get('BitsPerComponent', 8),
+                              params.get('Columns', 1))
+    elif predictor == 2:
+        raise ValueError('predictor TIFF no soportado')
+    return data
+
+## Decodifica un stream aplicando sus filtros
+#
+# Devuelve los datos decodificados, salvo que el último filtro sea de
+# imagen (CCITTFaxDecode, DCTDecode): en ese caso se detiene antes y
+# devuelve (datos, filtro, parámetros) para que lo resuelva decode_image.
+#
+# @param doc            PDFDocument (para resolver referencias)
+# @param data           datos crudos del stream
+# @param value          diccionario del stream
+# @param image          si es True se admiten filtros de imagen al final
+def decode_stream(doc, data, value, image=False):
+    filters = doc.resolve(value.get('Filter', []))
+    params = doc.resolve(value.get('DecodeParms', []))
+    if not isinstance(filters, list):
+        filters, params = [filters], [params]
+    if not isinstance(params, list):
+        params = [params]
+    params = [doc.resolve(p) or {} for p in params] + [{}] * (len(filters) - len(params))
+
+    for n, (name, param) in enumerate(zip(filters, params)):
+        param = dict((k, doc.resolve(v)) for k, v in param.items())
+        if name in ('FlateDecode', 'Fl'):
+            data = _flate_decode(data, param)
+        elif image and name in ('CCITTFaxDecode', 'CCF', 'DCTDecode', 'DCT') and n == len(filters) - 1:
+            return data, name, param
+        else:
+            raise ValueError('filtro no soportado: %s' % name)
+    return data
+
+# ----------------------------------------------------------------------
+# CCITT Grupo 4
+
+_WHITE_CODES = {
+    '00110101': 0, '000111': 1, '0111': 2, '1000': 3, '1011': 4, '1100': 5,
+    '1110': 6, '1111': 7, '10011': 8, '10100': 9, '00111': 10, '01000': 11,
+    '001000': 12, '000011': 13, '110100': 14, '110101': 15, '101010': 16,
+    '101011': 17, '0100111': 18, '0001100': 19, '0001000': 20, '0010111': 21,
+    '0000011': 22, '0000100': 23, '0101000': 24, '0101011': 25, '0010011': 26,
+    '0100100': 27, '0011000': 28, '00000010': 29, '00000011': 30, '00011010': 31,
+    '00011011': 32, '00010010': 33, '00010011': 34, '00010100': 35, '00010101': 36,
+    '00010110': 37, '00010111': 38, '00101000': 39, '00101001': 40, '00101010': 41,
+    '00101011': 42, '00101100': 43, '00101101': 44, '00000100': 45, '00000101': 46,
+    '00001010': 47, '00001011': 48, '01010010': 49, '01010011': 50, '01010100': 51,
+    '01010101': 52, '00100100': 53, '00100101': 54, '01011000': 55, '01011001': 56,
+    '01011010': 57, '01011011': 58, '01001010': 59, '01001011': 60, '00110010': 61,
+    '00110011': 62, '00110100': 63,
+    '11011': 64, '10010': 128, '010111': 192, '0110111': 256, '00110110': 320,
+    '00110111': 384, '01100100': 448, '01100101': 512, '01101000': 576,
+    '01100111': 640, '011001100': 704, '011001101': 768, '011010010': 832,
+    '011010011': 896, '011010100': 960, '011010101': 1024, '011010110': 1088,
+    '011010111': 1152, '011011000': 1216, '011011001': 1280, '011011010': 1344,
+    '011011011': 1408, '010011000': 1472, '010011001': 1536, '010011010': 1600,
+    '011000': 1664, '010011011': 1728,
+}
+
+_BLACK_CODES = {
+    '0000110111': 0, '010': 1, '11': 2, '10': 3, '011': 4, '0011': 5, '0010': 6,
+    '00011': 7, '000101': 8, '000100': 9, '0000100': 10, '0000101': 11,
+    '0000111': 12, '00000100': 13, '00000111': 14, '000011000': 15,
+    '0000010111': 16, '0000011000': 17, '0000001000': 18, '00001100111': 19,
+    '00001101000': 20, '00001101100': 21, '00000110111': 22, '00000101000': 23,
+    '00000010111': 24, '00000011000': 25, '000011001010': 26, '000011001011': 27,
+    '000011001100': 28, '000011001101': 29, '000001101000': 30, '000001101001': 31,
+    '000001101010': 32, '000001101011': 33, '000011010010': 34, '000011010011': 35,
+    '000011010100': 36, '000011010101': 37, '000011010110': 38, '000011010111': 39,
+    '000001101100': 40, '000001101101': 41, '000011011010': 42, '000011011011': 43,
+    '000001010100': 44, '000001010101': 45, '000001010110': 46, '000001010111': 47,
+    '000001100100': 48, '000001100101': 49, '000001010010': 50, '000001010011': 51,
+    '000000100100': 52, '000000110111': 53, '000000111000': 54, '000000100111': 55,
+    '000000101000': 56, '000001011000': 57, '000001011001': 58, '000000101011': 59,
+    '000000101100': 60, '000001011010': 61, '000001100110': 62, '000001100111': 63,
+    '0000001111': 64, '000011001000': 128, '000011001001': 192, '000001011011': 256,
+    '000000110011': 320, '000000110100': 384, '000000110101': 448,
+    '0000001101100': 512, '0000001101101': 576, '0000001001010': 640,
+    '0000001001011': 704, '0000001001100': 768, '0000001001101': 832,
+    '0000001110010': 896, '0000001110011': 960, '0000001110100': 1024,
+    '0000001110101': 1088, '0000001110110': 1152, '0000001110111': 1216,
+    '0000001010010': 1280, '0000001010011': 1344, '0000001010100': 1408,
+    '0000001010101': 1472, '0000001011010': 1536, '0000001011011': 1600,
+    '0000001100100': 1664, '0000001100101': 1728,
+}
+
+# códigos de make-up extendidos (comunes a blanco y negro)
+_EXTENDED_CODES = {
+    '00000001000': 1792, '00000001100': 1856, '00000001101': 1920,
+    '000000010010': 1984, '000000010011': 2048, '000000010100': 2112,
+    '000000010101': 2176, '000000010110': 2240, '000000010111': 2304,
+    '000000011100': 2368, '000000011101': 2432, '000000011110': 2496,
+    '000000011111': 2560,
+}
+
+# modos de codificación 2D: 'P' (pasada), 'H' (horizontal), o el desplazamiento vertical
+_MODE_CODES = {
+    '0001': 'P', '001': 'H', '1': 0, '011': 1, '000011': 2, '0000011': 3,
+    '010': -1, '000010': -2, '0000010': -3, '000000000001': 'EOL',
+}
+
+_PEEK = 13
+
+## Tabla de decodificación: cada prefijo de _PEEK bits -> (valor, largo del código)
+def _lookup_table(codes):
+    table = {}
+    for code, value in codes.items():
+        free = _PEEK - len(code)
+        for n in range(1 << free):
+            suffix = format(n, '0%db' % free) if free else ''
+            key = code + suffix
+            assert key not in table, 'códigos CCITT ambiguos'
+            table[key] = (value, len(code))
+    return table
+
+_WHITE_TABLE = _lookup_table(dict(_WHITE_CODES, **_EXTENDED_CODES))
+_BLACK_TABLE = _lookup_table(dict(_BLACK_CODES, **_EXTENDED_CODES))
+_MODE_TABLE = _lookup_table(_MODE_CODES)
+_BYTE_BITS = [format(n, '08b') for n in range(256)]
+
+## Decodifica datos CCITT Grupo 4 (T.6)
+#
+# Devuelve un PackedImage con los pixels negros en 1.
+#
+# @param data           datos comprimidos
+# @param width          ancho de la imagen (Columns)
+# @param height         alto de la imagen (Rows); None: hasta el fin de los datos
+def decode_g4(data, width, height=None):
+    bits = ''.join([_BYTE_BITS[b] for b in bytearray(data)])
+    nbits = len(bits)
+    bits += '0' * (2 * _PEEK)
+
+    def read_run(pos, table):
+        run = 0
+        while True:
+            entry = table.get(bits[pos:pos+_PEEK])
+            if entry is None:
+                raise ValueError('código CCITT inválido en el bit %d' % pos)
+            value, length = entry
+            run += value
+            pos += length
+            if value < 64:
+                return run, pos
+
+    rows, cols = [], []
+    ref = [width, width]    # cambios de color de la línea de referencia
+    pos, row = 0, 0
+    while (height is None or row < height) and pos < nbits:
+        cur = []
+        a0, color, j = -1, 0, 0
+        while a0 < width:
+            entry = _MODE_TABLE.get(bits[pos:pos+_PEEK])
+            if entry is None:
+                raise ValueError('código CCITT inválido en el bit %d' % pos)
+            mode, length = entry
+            pos += length
+
+            # b1: primer cambio de la línea de referencia a la derecha de a0
+            # hacia el color opuesto al actual (los índices pares son cambios
+            # a negro); b2: el cambio siguiente
+            while ref[j] <= a0 and ref[j] < width:
+                j += 1
+            b1 = j if j % 2 == color else j + 1
+            b1 = min(b1, len(ref) - 1)
+
+            if mode == 'P':
+                a0 = ref[min(b1 + 1, len(ref) - 1)]
+            elif mode == 'H':
+                start = max(a0, 0)
+                run1, pos = read_run(pos, _BLACK_TABLE if color else _WHITE_TABLE)
+                run2, pos = read_run(pos, _WHITE_TABLE if color else _BLACK_TABLE)
+                a1 = min(start + run1, width)
+                a0 = min(a1 + run2, width)
+                cur.append(a1)
+                cur.append(a0)
+            elif mode == 'EOL':
+                # fin de bloque (EOFB)
+                pos = nbits
+                break
+            else:
+                a0 = ref[b1] + mode
+                if a0 < 0 or a0 > width:
+                    raise ValueError('código vertical fuera de la línea en la fila %d' % row)
+                cur.append(a0)
+                color = 1 - color
+
+        if pos >= nbits and not cur and a0 < width:
+            break
+
+        # los cambios en el borde derecho no cuentan para la línea siguiente
+        while cur and cur[-1] >= width:
+            cur.pop()
+        rows.extend([row] * len(cur))
+        cols.extend(cur)
+        ref = cur + [width, width]
+        row += 1
+
+    if height is None:
+        height = row
+
+    # cada cambio de color invierte los pixels desde su posición hasta el fin
+    # de la fila
+    # (una posición repetida un número par de veces no cambia nada; se cuentan
+    # ordenando, np.unique no tiene return_counts en numpy 1.8)
+    flat = np.sort(np.array(rows, dtype='intp') * (width + 1) + np.array(cols, dtype='intp'))
+    toggles = np.zeros((height, width + 1), dtype='uint8')
+    if len(flat):
+        starts = np.flatnonzero(np.r_[True, flat[1:] != flat[:-1]])
+        counts = np.diff(np.r_[starts, len(flat)])
+        toggles.flat[flat[starts[counts % 2 == 1]]] = 1
+    img = np.bitwise_xor.accumulate(toggles, axis=1)[:, :width]
+    return PackedImage.from_array(img)
+
+# ----------------------------------------------------------------------
+# imágenes
+
+## Decodifica una imagen de un PDF
+#
+# Devuelve un PackedImage para las imágenes de 1 bit (con los valores tal
+# como están en el PDF) o un array uint8 (alto, ancho[, componentes]).
+#
+# @param doc            PDFDocument
+# @param num            número del objeto imagen
+def decode_image(doc, num):
+    value = dict((k, doc.resolve(v)) for k, v in doc.objects[num][0].items())
+    width, height = value['Width'], value['Height']
+    bpc = 1 if value.get('ImageMask') else value.get('BitsPerComponent', 8)
+
+    data = decode_stream(doc, doc.raw_stream(num), value, image=True)
+    if isinstance(data, tuple):
+        data, name, params = data
+        if name in ('CCITTFaxDecode', 'CCF'):
+            k = params.get('K', 0)
+            if k >= 0:
+                raise ValueError('CCITT con K=%d no soportado (sólo Grupo 4)' % k)
+            img = decode_g4(data, params.get('Columns', 1728), params.get('Rows', height))
+            if img.shape[0] < height:
+                raise ValueError('datos CCITT incompletos')
+            return img if params.get('BlackIs1', False) else img.invert()
+
+        from PIL import Image
+        from StringIO import StringIO
+        return np.asarray(Image.open(StringIO(data)))
+
+    colorspace = value.get('ColorSpace', 'DeviceGray')
+    if isinstance(colorspace, list):
+        colorspace = doc.resolve(colorspace[0])
+    ncomp = {'DeviceRGB': 3, 'CalRGB': 3, 'DeviceCMYK': 4}.get(colorspace, 1)
+
+    if bpc == 1 and ncomp == 1:
+        stride = (width + 7) // 8
+        packed = np.frombuffer(data, dtype='uint8', count=stride * height).reshape(height, stride)
+        img = PackedImage(packed.copy(), (height, width))
+        img._clear_padding(img.data)
+        return img
+    if bpc != 8:
+        raise ValueError('%d bits por componente no soportado' % bpc)
+    img = np.frombuffer(data, dtype='uint8', count=width * height * ncomp)
+    return img.reshape((height, width, ncomp) if ncomp > 1 else (height, width))
+
+## Verifica si un archivo es un PDF
+def is_pdf(path):
+    with open(path, 'rb') as f:
+        return f.read(4) == '%PDF'
+
+## Imágenes de un PDF, en el orden en que aparecen en el archivo
+#
+# @param pdf_file       path al PDF
+def extract_images(pdf_file):
+    with open(pdf_file, 'rb') as f:
+        doc = PDFDocument(f.read())
+    return [decode_image(doc, num) for num in doc.image_objects()]
+
+## Graba una imagen como .pbm (1 bit), .pgm (gris) o .ppm (color)
+#
+# Devuelve el path del archivo generado. Se escribe en un archivo temporal
+# que luego se renombra, así un archivo de salida existente está siempre
+# completo.
+#
+# @param img            PackedImage o array uint8
+# @param base           path sin extensión
+def write_image(img, base):
+    if isinstance(img, PackedImage):
+        out_file, magic, raster = base + '.pbm', 'P4', img.data
+    elif img.ndim == 2:
+        out_file, magic, raster = base + '.pgm', 'P5', img
+    else:
+        out_file, magic, raster = base + '.ppm', 'P6', img[:, :, :3]
+
+    header = '%s\n%d %d\n' % (magic, img.shape[1], img.shape[0])
+    if magic != 'P4':
+        header += '255\n'
+    tmp_file = '%s.%d.tmp' % (out_file, os.getpid())
+    with open(tmp_file, 'wb') as f:
+        f.write(header)
+        f.write(np.ascontiguousarray(raster, dtype='uint8').tostring())
+    os.rename(tmp_file, out_file)
+    return out_file
+
+## Extrae y graba las imágenes de un PDF (como pdfimages: prefijo-000.pbm, ...)
+#
+# @param pdf_file       path al PDF
+# @param prefix         prefijo de los archivos de salida
+def pdf_to_images(pdf_file, prefix):
+    return [write_image(img, '%s-%03d' % (prefix, n))
+            for n, img in enumerate(extract_images(pdf_file))]
+
+def main():
+    if len(sys.argv) not in (2, 3):
+        print 'uso: python pdfimage.py archivo.pdf [prefijo]'
+        return 1
+    pdf_file = sys.argv[1]
+    prefix = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(pdf_file)[0]
+    for out_file in pdf_to_images(pdf_file, prefix):
+        print out_file
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Vista previa de la detección de un telegrama
+#
+# Dibuja sobre la imagen (en escala de procesamiento) la palabra clave, los
+# cuadriláteros detectados y las tablas/celdas del modelo alineado. Se genera
+# a partir de los resultados guardados por process_telegram (-DETECT.json),
+# de modo que matplotlib sólo se importa cuando efectivamente se pide una
+# vista previa y se puede correr después, sobre una muestra de telegramas.
+#
+#   $ python telegrama/preview.py [--every N] archivo-DETECT.json ...
+
+import os, sys
+import argparse
+
+from detections import DETECT_SUFFIX, load_detections
+
+PREVIEW_SUFFIX = '-PREVIEW.jpg'
+
+## Elige el backend sin display (Agg) de matplotlib
+#
+# Tiene que llamarse antes de que se importe pyplot, también indirectamente:
+# skimage.io (y skimage.data) lo importan al cargarse.
+def use_agg():
+    import matplotlib
+    matplotlib.use('Agg')
+
+## Genera la vista previa
+#
+# La imagen no se endereza: los rectángulos (en coordenadas de la imagen
+# enderezada) se dibujan como polígonos, llevados a la imagen con la
+# transformación guardada en detections['rectify'].
+#
+# @param detections      resultados de la detección (ver process_telegram)
+# @param out_file        path de la imagen a generar
+# @param img             imagen en escala de procesamiento, sin enderezar (si
+#                        es None se carga la imagen original y se reescala)
+def render_preview(detections, out_file, img=None):
+    use_agg()
+    import matplotlib.pyplot as plt
+    import matplotlib.cm as cm
+    from geometry import Affine
+
+    if img is None:
+        from skimage import transform
+        from loader import load_image
+        scale = detections['processing_scale']
+        if scale == 0.5:
+            # misma reducción que process_telegram
+            img = load_image(detections['image'], packed=True).reduce2().unpack()
+        else:
+            img = transform.rescale(load_image(detections['image']), scale) > 0
+
+    # las detecciones están sobre la imagen enderezada
+    rectify = Affine(detections['rectify']['matrix']) if 'rectify' in detections else Affine()
+
+    def box(x, y, w, h, color):
+        corners = rectify([[x, y], [x + w, y], [x + w, y + h], [x, y + h]])
+        return plt.Polygon(corners, closed=True, edgecolor=color, facecolor='none', linewidth=2)
+
+    fig, (ax1, ax2) = plt.subplots(ncols=2)
+
+    ax1.imshow(img, cmap=cm.Greys_r)
+    ax1.set_axis_off()
+
+    #palabra clave
+    for x, y, w, h in detections['keypatch']:
+        ax1.add_patch(box(x, y, w, h, 'r'))
+
+    #quads
+    for q in detections['quads']:
+        ax1.add_patch(box(q[0], q[1], q[2]-q[0], q[3]-q[1], 'y'))
+
+    ax2.imshow(img, cmap=cm.Greys_r)
+    ax2.set_axis_off()
+
+    #tablas y celdas
+    for fields, color in ((detections['tables'], 'r'), (detections['cells'], 'g')):
+        for field in fields:
+            ax2.add_patch(box(field[0], field[1], field[2], field[3], color))
+
+    plt.savefig(out_file, dpi=150)
+    plt.close(fig)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Vista previa de telegramas ya procesados")
+    parser.add_argument("detections", nargs='+',
+                        help="archivos " + DETECT_SUFFIX + " (o directorios donde buscarlos)")
+    parser.add_argument("--every", type=int, default=1,
+                        help="generar sólo una de cada N vistas previas")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    files = []
+    for path in args.detections:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                files.extend(os.path.join(dirpath, name) for name in sorted(filenames)
+                             if name.endswith(DETECT_SUFFIX))
+        else:
+            files.append(path)
+
+    for detect_file in files[::max(args.every, 1)]:
+        out_file = detect_file[:-len(DETECT_SUFFIX)] + PREVIEW_SUFFIX
+        print out_file
+        render_preview(load_detections(detect_file), out_file)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+
+## Registro de modelos de formulario precompilados
+#
+# Parsear el .svg del modelo (minidom) y reescalar el patch de la palabra
+# clave es caro y el resultado es siempre el mismo. Acá se hace una sola vez
+# por template: el resultado se guarda en un cache binario (.npz) al lado del
+# .svg, que se invalida cuando cambia alguno de los archivos de origen, y se
+# mantiene en memoria por proceso.
+
+import os
+import json
+import hashlib
+
+import numpy as np
+from skimage import transform
+
+from loader import parse_model, load_image
+
+CACHE_VERSION = 2
+CACHE_EXT = '.cache.npz'
+
+# templates ya cargados en este proceso
+_templates = {}
+
+## Identificación de un archivo de origen (para invalidar el cache)
+#
+# @param path           path al archivo
+def file_stamp(path):
+    st = os.stat(path)
+    with open(path, 'rb') as f:
+        sha1 = hashlib.sha1(f.read()).hexdigest()
+    return {'path': os.path.abspath(path), 'size': st.st_size,
+            'mtime': st.st_mtime, 'sha1': sha1}
+
+## Verifica si un archivo sigue siendo el mismo que se registró en el cache
+#
+# Primero compara tamaño y fecha de modificación; si no coinciden (p.ej. el
+# archivo se copió o se hizo checkout) compara el contenido por hash.
+#
+# @param stamp          identificación guardada en el cache
+# @param path           path al archivo
+def _same_file(stamp, path):
+    st = os.stat(path)
+    if stamp['size'] != st.st_size:
+        return False
+    if stamp['mtime'] == st.st_mtime:
+        return True
+    return stamp['sha1'] == file_stamp(path)['sha1']
+
+## Compila un template a partir de sus archivos de origen
+#
+# Devuelve un diccionario con:
+#   'tables', 'cells'   listas de [x, y, w, h, id] referidas al patch de referencia
+#   'reference'         rectángulo [x, y, w, h] del patch de referencia en la imagen
+#   'keypatch'          escala de procesamiento -> patch de la palabra clave reescalado
+#
+# @param model_file     modelo .svg
+# @param keyword_file   imagen de la palabra clave
+# @param scales         escalas de procesamiento para las que se reescala el patch
+def compile_template(model_file, keyword_file, scales):
+    tables, cells, reference = parse_model(model_file, return_reference=True)
+    keyword = load_image(keyword_file)
+    keypatch = {}
+    for scale in scales:
+        keypatch[scale] = transform.rescale(keyword, scale)
+    return {'tables': tables, 'cells': cells, 'reference': reference,
+            'keypatch': keypatch}
+
+## Conversión de listas de [x, y, w, h, id] a arrays (N, 4) de rectángulos + ids
+#
+# @param fields         lista de [x, y, w, h, id]
+def fields_to_arrays(fields):
+    rects = np.array([f[0:4] for f in fields], dtype='float64').reshape(-1, 4)
+    ids = np.array([f[4] for f in fields], dtype='U')
+    return rects, ids
+
+## Conversión inversa a fields_to_arrays
+#
+# @param rects          array (N, 4) de rectángulos [x, y, w, h]
+# @param ids            ids de los rectángulos
+def arrays_to_fields(rects, ids):
+    return [list(rect) + [id] for rect, id in zip(np.asarray(rects).tolist(), ids)]
+
+## Guarda el template compilado en el cache
+#
+# La escritura se hace en un archivo temporal y luego se renombra, para que
+# los procesos que leen en paralelo nunca vean un cache a medio escribir.
+def _write_cache(cache_file, template, sources):
+    scales = sorted(template['keypatch'])
+    header = {'version': CACHE_VERSION, 'sources': sources, 'scales': scales}
+    arrays = {'header': np.array(json.dumps(header)),
+              'reference': np.array(template['reference'], dtype='float64')}
+    arrays['table_rects'], arrays['table_ids'] = fields_to_arrays(template['tables'])
+    arrays['cell_rects'], arrays['cell_ids'] = fields_to_arrays(template['cells'])
+    for n, scale in enumerate(scales):
+        arrays['keypatch_%d' % n] = template['keypatch'][scale]
+
+    tmp_file = '%s.%d.tmp' % (cache_file, os.getpid())
+    with open(tmp_file, 'wb') as f:
+        np.savez(f, **arrays)
+    os.rename(tmp_file, cache_file)
+
+## Lee un template del cache; devuelve None si no existe o no es válido
+def _read_cache(cache_file, model_file, keyword_file, scales):
+    if not os.path.exists(cache_file):
+        return None
+    try:
+        data = np.load(cache_file)
+    except (IOError, ValueError):
+        return None
+    try:
+        return _read_template(data, model_file, keyword_file, scales)
+    except (IOError, ValueError, KeyError):
+        return None
+    finally:
+        data.close()
+
+## Template guardado en un cache abierto (NpzFile); None si no está al día
+def _read_template(data, model_file, keyword_file, scales):
+    header = json.loads(str(data['header']))
+    if header.get('version') != CACHE_VERSION or not set(scales) <= set(header['scales']):
+        return None
+    model_stamp, keyword_stamp = header['sources']
+    if not (_same_file(model_stamp, model_file) and _same_file(keyword_stamp, keyword_file)):
+        return None
+
+    keypatch = {}
+    for n, scale in enumerate(header['scales']):
+        keypatch[scale] = data['keypatch_%d' % n]
+    return {'tables': arrays_to_fields(data['table_rects'], data['table_ids']),
+            'cells': arrays_to_fields(data['cell_rects'], data['cell_ids']),
+            'reference': data['reference'].tolist(),
+            'keypatch': keypatch}
+
+## Carga un template, usando el cache en disco si está al día
+#
+# @param model_file     modelo .svg
+# @param keyword_file   imagen de la palabra clave
+# @param scales         escalas de procesamiento necesarias
+# @param cache_file     path al cache (por defecto al lado del .svg)
+def load_template(model_file, keyword_file, scales=(0.5,), cache_file=None):
+    if cache_file is None:
+        cache_file = model_file + CACHE_EXT
+
+    template = _read_cache(cache_file, model_file, keyword_file, scales)
+    if template is None:
+        template = compile_template(model_file, keyword_file, scales)
+        sources = [file_stamp(model_file), file_stamp(keyword_file)]
+        try:
+            _write_cache(cache_file, template, sources)
+        except (IOError, OSError):
+            # sin permisos de escritura: se usa sólo en memoria
+            pass
+    return template
+
+## Devuelve el template (cargado una sola vez por proceso)
+#
+# @param model_file     modelo .svg
+# @param keyword_file   imagen de la palabra clave
+# @param scales         escalas de procesamiento necesarias
+def get_template(model_file, keyword_file, scales=(0.5,)):
+    key = (os.path.abspath(model_file), os.path.abspath(keyword_file), tuple(sorted(scales)))
+    if key not in _templates:
+        _templates[key] = load_template(model_file, keyword_file, scales)
+    return _templates[key]
+
+## Copia de las tablas y celdas del template, para poder modificarlas
+#
+# @param template       template devuelto por get_template
+def model_fields(template):
+    tables = [list(field) for field in template['tables']]
+    cells = [list(field) for field in template['cells']]
+    return tables, cells
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+
+## Detección de trazos horizontales y verticales por run-lengths
+#
+# Sobre una imagen ya rectificada, los trazos horizontales son tramos de
+# pixels encendidos consecutivos en una fila (y los verticales, en una
+# columna). Se calculan todos los tramos de la imagen con operaciones
+# vectorizadas, se unen los tramos de una misma fila separados por huecos de
+# a lo sumo `maxgap` pixels y se descartan los de longitud menor a `minlen`.
+# El costo es lineal en la cantidad de pixels y el resultado determinístico.
+#
+# Si la imagen no está enderezada, en lugar de rotarla se le aplica un corte
+# (shear) de corrimientos enteros que deja horizontales a las líneas
+# horizontales (y otro para las verticales), y los extremos de los tramos se
+# llevan después a coordenadas enderezadas.
+
+import numpy as np
+
+from geometry import shift_rows, shift_cols
+
+## Tramos horizontales de una imagen binaria
+#
+# Devuelve tres arrays (fila, columna inicial, columna final), con los
+# extremos inclusivos.
+#
+# @param img            imagen binaria
+# @param minlen         longitud mínima (distancia entre extremos)
+# @param maxgap         hueco máximo entre tramos que se consideran uno solo
+def row_runs(img, minlen, maxgap):
+    rows, cols = img.shape
+    padded = np.zeros((rows, cols + 2), dtype='int8')
+    padded[:, 1:-1] = img
+    edges = np.diff(padded, axis=1)
+
+    # np.nonzero recorre por filas, así que inicios y fines quedan apareados
+    row, start = np.nonzero(edges == 1)
+    end = np.nonzero(edges == -1)[1] - 1
+    if len(row) == 0:
+        return row, start, end
+
+    # une tramos de la misma fila separados por huecos chicos
+    gap = start[1:] - end[:-1] - 1
+    join = (row[1:] == row[:-1]) & (gap <= maxgap)
+    first = np.flatnonzero(np.r_[True, ~join])
+    last = np.r_[first[1:] - 1, len(row) - 1]
+    row, start, end = row[first], start[first], end[last]
+
+    keep = end - start >= minlen
+    return row[keep], start[keep], end[keep]
+
+## Detección de líneas horizontales y verticales
+#
+# Devuelve una lista de segmentos ((x0, y0), (x1, y1)) con el mismo formato
+# que transform.probabilistic_hough.
+#
+# @param img            imagen binaria (rectificada)
+# @param minlen         longitud mínima de las líneas
+# @param maxgap         hueco máximo dentro de una línea
+def detect_line_segments(img, minlen, maxgap):
+    img = img > 0
+    lines = []
+
+    row, start, end = row_runs(img, minlen, maxgap)
+    lines.extend(((x0, y), (x1, y)) for y, x0, x1 in zip(row.tolist(), start.tolist(), end.tolist()))
+
+    col, start, end = row_runs(img.T, minlen, maxgap)
+    lines.extend(((x, y0), (x, y1)) for x, y0, y1 in zip(col.tolist(), start.tolist(), end.tolist()))
+
+    return lines
+
+## Detección de líneas sobre una imagen sin enderezar
+#
+# Las líneas horizontales de la página tienen pendiente tan(a) en la imagen
+# (y las verticales, -tan(a)): un corrimiento entero de cada columna (de
+# cada fila) las deja horizontales (verticales), sin remuestrear la imagen.
+# Devuelve los segmentos en coordenadas de la imagen enderezada, con el
+# formato de detect_line_segments.
+#
+# @param img            imagen binaria sin enderezar
+# @param tform          transformación imagen enderezada -> img (ver
+#                       geometry.rotation_transform)
+# @param minlen         longitud mínima de las líneas
+# @param maxgap         hueco máximo dentro de una línea
+def detect_rotated_line_segments(img, tform, minlen, maxgap):
+    img = img > 0
+    rows, cols = img.shape
+    slope = tform.matrix[1, 0] / tform.matrix[0, 0]
+    inverse = tform.inverse()
+    lines = []
+
+    # las líneas se engrosan un pixel (hacia abajo o a la derecha, de ahí el
+    # medio pixel al volver) para que los escalones del trazado no las corten
+
+    # horizontales: la fila y + slope*x de la columna x pasa a la fila y
+    shifts = np.floor(slope * np.arange(cols) + 0.5).astype('intp')
+    shifts -= shifts.max()
+    sheared = shift_cols(img, shifts, rows - shifts.min())
+    sheared[1:] |= sheared[:-1].copy()
+    row, start, end = row_runs(sheared, minlen, maxgap)
+    p0 = inverse(np.column_stack([start, row + shifts[start] - 0.5]))
+    p1 = inverse(np.column_stack([end, row + shifts[end] - 0.5]))
+    y = np.floor(0.5 * (p0[:, 1] + p1[:, 1]) + 0.5).astype('int').tolist()
+    x0 = np.floor(p0[:, 0] + 0.5).astype('int').tolist()
+    x1 = np.floor(p1[:, 0] + 0.5).astype('int').tolist()
+    lines.extend(((a, c), (b, c)) for a, b, c in zip(x0, x1, y))
+
+    # verticales: la columna x - slope*y de la fila y pasa a la columna x
+    shifts = np.floor(-slope * np.arange(rows) + 0.5).astype('intp')
+    shifts -= shifts.max()
+    sheared = shift_rows(img, shifts, cols - shifts.min())
+    sheared[:, 1:] |= sheared[:, :-1].copy()
+    col, start, end = row_runs(sheared.T, minlen, maxgap)
+    p0 = inverse(np.column_stack([col + shifts[start] - 0.5, start]))
+    p1 = inverse(np.column_stack([col + shifts[end] - 0.5, end]))
+    x = np.floor(0.5 * (p0[:, 0] + p1[:, 0]) + 0.5).astype('int').tolist()
+    y0 = np.floor(p0[:, 1] + 0.5).astype('int').tolist()
+    y1 = np.floor(p1[:, 1] + 0.5).astype('int').tolist()
+    lines.extend(((c, a), (c, b)) for a, b, c in zip(y0, y1, x))
+
+    return lines
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Estimación determinística de la inclinación del formulario
+#
+# Alternativa a la estimación por transformada de Hough probabilística de
+# telegrama.estimate_rotation: se busca el ángulo para el cual el perfil de
+# proyección de los pixels (sobre la normal a ese ángulo) es más "picudo",
+# es decir, el ángulo en que las líneas del formulario y los renglones
+# quedan alineados. La búsqueda es de grueso a fino sobre una versión
+# reducida de la página, en el rango de +-45 grados que asume el resto del
+# procesamiento.
+#
+# Corriendo este archivo se compara contra la estimación por Hough sobre el
+# telegrama de ejemplo y copias rotadas sintéticamente:
+#
+#   $ python telegrama/skew.py [--angles -10 -3 0 2 7] [--runs 3]
+
+import os, sys
+import argparse
+import time
+
+import numpy as np
+
+## Reducción de una imagen binaria por bloques (un bloque es 1 si tiene algún pixel en 1)
+#
+# @param img            imagen binaria
+# @param factor         factor de reducción (entero)
+def reduce_any(img, factor):
+    if factor <= 1:
+        return img
+    h, w = img.shape[0] // factor, img.shape[1] // factor
+    img = img[:h*factor, :w*factor].reshape(h, factor, w, factor)
+    return img.any(axis=3).any(axis=1)
+
+## Score del perfil de proyección para cada ángulo
+#
+# @param ys, xs         coordenadas de los pixels encendidos
+# @param angles         ángulos a evaluar (en grados)
+def _profile_scores(ys, xs, angles):
+    scores = np.empty(len(angles))
+    for n, angle in enumerate(np.deg2rad(angles)):
+        r = ys * np.cos(angle) - xs * np.sin(angle)
+        r = np.round(r - r.min()).astype('intp')
+        hist = np.bincount(r)
+        scores[n] = np.dot(hist, hist)
+    return scores
+
+## Estimación del ángulo de rotación por perfiles de proyección
+#
+# Devuelve el ángulo (en grados) con la misma convención que
+# telegrama.estimate_rotation.
+#
+# @param img            imagen binaria
+# @param factor         factor de reducción adicional de la imagen antes de proyectar
+# @param max_angle      se busca en el rango [-max_angle, max_angle]
+# @param step           resolución final de la búsqueda (en grados)
+def estimate_rotation_projection(img, factor=1, max_angle=45., step=0.02):
+    assert(img.dtype == 'bool')
+
+    small = reduce_any(img, factor)
+    ys, xs = np.nonzero(small)
+    if len(ys) == 0:
+        return 0.
+    ys = ys.astype('float64')
+    xs = xs.astype('float64')
+
+    # búsqueda de grueso a fino: en cada nivel se evalúa una grilla alrededor
+    # del mejor ángulo del nivel anterior y se reduce el paso
+    center, half_range, delta = 0., max_angle, 1.
+    while True:
+        angles = np.arange(-half_range, half_range + 0.5*delta, delta) + center
+        angles = angles[np.abs(angles) <= max_angle]
+        center = angles[_profile_scores(ys, xs, angles).argmax()]
+        if delta <= step:
+            return float(center)
+        half_range, delta = delta, max(delta / 10., step)
+
+# ----------------------------------------------------------------------
+
+PATH = os.path.dirname(os.path.abspath(__file__))
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Comparación de estimadores de rotación")
+    parser.add_argument("image_file", nargs='?', default=os.path.join(PATH, '040240351_7634.pbm'),
+                        help="imagen del telegrama (por defecto, el de ejemplo)")
+    parser.add_argument("--angles", type=float, nargs='+', default=[-10., -3., 0., 2., 7.],
+                        help="rotaciones sintéticas a aplicar (en grados)")
+    parser.add_argument("--runs", type=int, default=3,
+                        help="corridas de cada estimador (Hough no es determinístico)")
+    return parser.parse_args()
+
+def main():
+    from skimage import transform, morphology
+    from telegrama import load_image, estimate_rotation
+
+    args = parse_args()
+
+    # mismo preprocesamiento que process_telegram
+    img = load_image(args.image_file)
+    img = transform.rescale(img, 0.5) > 0
+    img = morphology.remove_small_objects(img, min_size=64, connectivity=8)
+
+    # inclinación propia del telegrama (sin rotación sintética)
+    reference = estimate_rotation(img, 'projection')
+
+    print '%8s %8s | %-28s %8s | %-28s %8s' % ('rotación', 'esperado', 'hough', 't[s]', 'proyección', 't[s]')
+    for angle in args.angles:
+        rotated = img
+        if angle != 0:
+            rotated = transform.rotate(img, angle=angle, resize=True, order=0) > 0
+
+        results = []
+        for method in ('hough', 'projection'):
+            estimates = []
+            start = time.time()
+            for n in range(args.runs):
+                estimates.append(estimate_rotation(rotated, method))
+            results.append((estimates, (time.time() - start) / args.runs))
+
+        row = ['%8.2f %8.2f' % (angle, reference - angle)]
+        for estimates, elapsed in results:
+            spread = ' '.join('%.2f' % e for e in estimates)
+            row.append('%-28s %8.3f' % (spread, elapsed))
+        print ' | '.join(row)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
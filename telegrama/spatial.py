@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+## Búsquedas de vecinos por grilla
+#
+# Los puntos se agrupan en celdas cuadradas de lado igual al radio de
+# búsqueda, de modo que dos puntos a distancia menor que el radio caen en la
+# misma celda o en celdas vecinas.
+
+import numpy as np
+
+# desplazamientos a las 9 celdas vecinas (incluida la propia)
+_NEIGHBOURS = [(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+
+## Celda de la grilla que le corresponde a cada punto
+def _cells(points, size):
+    return np.floor(np.asarray(points, dtype='float64') / size).astype('int64')
+
+## Pares de puntos a distancia menor que `radius`
+#
+# Devuelve dos arrays (i, j) con i < j, ordenados por i y luego por j.
+#
+# @param points         array (N, 2) de coordenadas
+# @param radius         distancia máxima (estricta)
+def close_pairs(points, radius):
+    points = np.asarray(points, dtype='float64').reshape(-1, 2)
+    n = len(points)
+    if n < 2 or radius <= 0:
+        return np.zeros(0, dtype='intp'), np.zeros(0, dtype='intp')
+
+    # clave entera única por celda (con un margen de una celda para los vecinos)
+    cells = _cells(points, radius)
+    cells -= cells.min(axis=0) - 1
+    stride = cells[:, 1].max() + 2
+    keys = cells[:, 0] * stride + cells[:, 1]
+    order = np.argsort(keys, kind='mergesort')
+    sorted_keys = keys[order]
+
+    ii, jj = [], []
+    for dx, dy in _NEIGHBOURS:
+        nkeys = keys + dx * stride + dy
+        left = np.searchsorted(sorted_keys, nkeys, 'left')
+        counts = np.searchsorted(sorted_keys, nkeys, 'right') - left
+        total = counts.sum()
+        if total == 0:
+            continue
+        # expande los rangos [left, left+count) de cada punto
+        i = np.repeat(np.arange(n), counts)
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        j = order[np.repeat(left, counts) + offsets]
+        keep = i < j
+        ii.append(i[keep])
+        jj.append(j[keep])
+
+    if len(ii) == 0:
+        return np.zeros(0, dtype='intp'), np.zeros(0, dtype='intp')
+    i, j = np.concatenate(ii), np.concatenate(jj)
+    d = points[i] - points[j]
+    keep = (d * d).sum(axis=1) < radius * radius
+    i, j = i[keep], j[keep]
+
+    idx = np.lexsort((j, i))
+    return i[idx], j[idx]
+
+## Índice de puntos para consultas de vecindad
+#
+# Tabla de hash celda -> índices de los puntos que caen en ella. Cada
+# consulta revisa sólo las 9 celdas alrededor del punto consultado.
+class PointGrid(object):
+
+    ## @param points     secuencia de puntos (x, y)
+    #  @param radius     radio de las consultas (y lado de las celdas)
+    def __init__(self, points, radius):
+        self.points = [(float(p[0]), float(p[1])) for p in points]
+        self.radius = radius
+        self.cells = {}
+        for n, (x, y) in enumerate(self.points):
+            key = (int(np.floor(x / radius)), int(np.floor(y / radius)))
+            self.cells.setdefault(key, []).append(n)
+
+    ## Índices de los puntos a distancia menor que el radio de `p`
+    #
+    # Se devuelven en orden creciente. Si se indica `max_count`, sólo los
+    # `max_count` más próximos.
+    #
+    # @param p          punto (x, y)
+    # @param max_count  cantidad máxima de puntos a devolver
+    def query(self, p, max_count=None):
+        x, y = p[0], p[1]
+        cx, cy = int(np.floor(x / self.radius)), int(np.floor(y / self.radius))
+        r2 = self.radius * self.radius
+        found = []
+        for dx, dy in _NEIGHBOURS:
+            for n in self.cells.get((cx + dx, cy + dy), ()):
+                px, py = self.points[n]
+                d2 = (x - px) * (x - px) + (y - py) * (y - py)
+                if d2 < r2:
+                    found.append((d2, n))
+        if max_count is not None and len(found) > max_count:
+            found = sorted(found)[:max_count]
+        return sorted(n for d2, n in found)
@@ -2,42 +2,38 @@
 # -*- coding: utf-8 -*-
 
 import numpy as np
-from skimage import io, data, filter, transform, morphology, feature
-from xml.dom import minidom
-from scipy import signal
+from skimage import transform, morphology, feature
+from scipy import signal, ndimage
+from collections import OrderedDict
+from crop import crop, crop_box, crop_fields
+from skew import estimate_rotation_projection
+from runlength import detect_line_segments, detect_rotated_line_segments
+from spatial import close_pairs, PointGrid
+from loader import load_image, parse_model
+from container import save_container, CONTAINER_SUFFIX
+from geometry import Affine, rotation_transform, warp_sheared, warp_fields
+from digits import segment_components, digit_samples
+from tracing import Tracer, write_trace
+from detections import save_detections, load_detections
 
 def sqdist(p0, p1):
     dx = p0[0] - p1[0]
     dy = p0[1] - p1[1]
     return dx*dx + dy*dy
 
-## Lee una imagen para procesar por OCR
-#
-# @param file           path a la imagen
-def load_image(file):
-    # TODO: forzar escala de grises
-
-    # lee la imagen
-    img = data.load(file)
-
-    # la binariza en caso de que sea escala de grises
-    if not img.dtype == 'bool':
-        thr = filter.threshold_otsu(img)
-        img = img > thr
-
-    #si la proporcion de pixels en blanco es mayor a la mitad, la invierte
-    if img.sum() > 0.5 * img.size:
-        img = np.bitwise_not(img);
-
-    return img
-
 ## Estimación del angulo de rotacion del formulario
 #
 # @param img                imagen binaria
-# @param processing_scale   factor de escala que aplico a la imagen antes del procesamiento
-def estimate_rotation(img):
+# @param method             'hough' (transformada de Hough probabilística) o
+#                           'projection' (perfiles de proyección, ver skew.py)
+def estimate_rotation(img, method='hough'):
     assert(img.dtype == 'bool')
 
+    if method == 'projection':
+        return estimate_rotation_projection(img)
+    elif method != 'hough':
+        raise ValueError("Unknown rotation estimation method: %r" % method)
+
     # elimina bloques rellenos para acelerar la deteccion de lineas
     elem = morphology.square(2)
     aux = morphology.binary_dilation(img, elem) - morphology.binary_erosion(img, elem)
@@ -68,19 +64,75 @@ def estimate_rotation(img):
     alpha = binval[h.argmax()] * (180./ np.math.pi)
     return alpha + 0.5 * (binval[1] - binval[0]) * (180./ np.math.pi)
 
+## Fusión de líneas duplicadas
+#
+# Cada línea absorbe a las siguientes (en el orden de la lista) que tienen
+# ambos extremos a distancia menor que `dthr` de los suyos y que no fueron
+# absorbidas antes; el resultado es el promedio de las líneas del grupo. Los
+# pares candidatos se buscan con una grilla (ver spatial.py) en lugar de
+# comparar todas las líneas entre sí.
+#
+# @param lines          lista de [x0, y0, x1, y1, xc, yc, len]
+# @param dthr           distancia máxima entre extremos
+def merge_lines(lines, dthr):
+    n = len(lines)
+    if n == 0:
+        return []
+    arr = np.array(lines, dtype='float64')
+
+    # pares con ambos extremos próximos
+    i, j = close_pairs(arr[:, 0:2], dthr)
+    d = arr[i, 2:4] - arr[j, 2:4]
+    keep = (d * d).sum(axis=1) < dthr * dthr
+    i, j = i[keep].tolist(), j[keep].tolist()
+
+    # asignación de cada línea al grupo de la primera que la absorbe
+    label = range(n)
+    removed = [False] * n
+    for a, b in zip(i, j):
+        if not removed[a] and not removed[b]:
+            label[b] = a
+            removed[b] = True
+
+    count = np.bincount(label, minlength=n)
+    acc = np.column_stack([np.bincount(label, arr[:, k], minlength=n) for k in range(4)])
+    keep = np.logical_not(removed)
+    merged = acc[keep] / count[keep].reshape(-1, 1)
+
+    x0, y0, x1, y1 = merged.T
+    dx, dy = x0 - x1, y0 - y1
+    return np.column_stack([merged, 0.5 * (x0+x1), 0.5 * (y0+y1), np.sqrt(dx*dx + dy*dy)]).tolist()
+
 ## Detección de lineas horizontales y verticales
 #
 # @param img            imagen
 # @param simplify       si es True, se eliminan líneas redundates
-def detect_lines(img, simplify=False):
-    minsize = min(img.shape)
-    maxsize = max(img.shape)
+# @param method         'hough' (transformada de Hough probabilística) o
+#                       'runlength' (tramos por filas y columnas, ver runlength.py)
+# @param rectify        par (transformación, tamaño) devuelto por
+#                       rotation_transform: si se indica, `img` es la imagen sin
+#                       enderezar y las líneas se devuelven en coordenadas de la
+#                       imagen enderezada (con 'runlength' sin enderezarla)
+def detect_lines(img, simplify=True, method='hough', rectify=None):
+    shape = img.shape if rectify is None else rectify[1]
+    minsize = min(shape)
+    maxsize = max(shape)
 
-    # Detección de lineas usando transformada de Hough probabilística
     minlen = 0.1 * minsize
     maxgap = 0.1 * minlen
-    angles = np.array([0, np.math.pi/2]) # asume imagen rectificada
-    lines = transform.probabilistic_hough(img, theta=angles, threshold=10, line_length=minlen, line_gap=maxgap)
+    if method == 'hough':
+        if rectify is not None:
+            img = warp_sheared(img, rectify[0], rectify[1], any_neighbour=True)
+        # Detección de lineas usando transformada de Hough probabilística
+        angles = np.array([0, np.math.pi/2]) # asume imagen rectificada
+        lines = transform.probabilistic_hough(img, theta=angles, threshold=10, line_length=minlen, line_gap=maxgap)
+    elif method == 'runlength':
+        if rectify is None:
+            lines = detect_line_segments(img, minlen, maxgap)
+        else:
+            lines = detect_rotated_line_segments(img, rectify[0], minlen, maxgap)
+    else:
+        raise ValueError("Unknown line detection method: %r" % method)
 
     # separa líneas verticales y horizontales
     vlines = []
@@ -106,34 +158,8 @@ def detect_lines(img, simplify=False):
     # filtrado de líneas duplicadas
     if simplify:
         dthr = 0.01 * minsize
-        dthr = dthr * dthr
-
-        for lines in (vlines, hlines):
-            i = 0
-            while i < len(lines):
-                l1 = lines[i]
-
-                acc = np.array(l1)
-                nacc = 1.0
-
-                j = i+1
-                while j < len(lines):
-                    l2 = lines[j]
-                    d1 = sqdist(l1[0:2], l2[0:2])
-                    d2 = sqdist(l1[2:4], l2[2:4])
-                    # ambos extremos están muy próximos entre si
-                    if d1 < dthr and d2 < dthr:
-                        acc = acc + np.array(l2)
-                        nacc = nacc + 1.0
-                        lines.pop(j)
-                    else:
-                        j = j+1
-
-                lines[i] = (acc/nacc).tolist()
-                lines[i][4] = 0.5 * (lines[i][0]+lines[i][2])
-                lines[i][5] = 0.5 * (lines[i][1]+lines[i][3])
-                lines[i][6] =  np.math.sqrt(sqdist((lines[i][0],lines[i][1]), (lines[i][2],lines[i][3])))
-                i = i+1
+        vlines = merge_lines(vlines, dthr)
+        hlines = merge_lines(hlines, dthr)
 
     # # ordena por longitud decreciente
     # vlines = sorted(vlines, key=lambda a_entry: a_entry[6])
@@ -143,24 +169,126 @@ def detect_lines(img, simplify=False):
 
     return hlines, vlines
 
+## Reducción de resolución por promedio de bloques de factor x factor
+#
+# @param img            imagen
+# @param factor         factor de reducción (entero)
+def downscale(img, factor):
+    h, w = img.shape[0] // factor, img.shape[1] // factor
+    img = np.asarray(img[:h*factor, :w*factor], dtype='float64')
+    return img.reshape(h, factor, w, factor).mean(axis=3).mean(axis=1)
+
+## Región de búsqueda de la palabra clave
+#
+# Rectángulo [x, y, w, h] alrededor de la posición que ocupa el patch de
+# referencia en el modelo, agrandado en una fracción del tamaño de la página
+# para tolerar desplazamientos y la rotación del escaneo.
+#
+# @param reference      rectángulo [x, y, w, h] del patch en el modelo
+# @param scale          escala de procesamiento
+# @param shape          tamaño de la imagen en la que se busca
+# @param margin         margen como fracción del tamaño de la página
+def keypatch_search_region(reference, scale, shape, margin=0.2):
+    mx, my = margin * shape[1], margin * shape[0]
+    x, y = reference[0] * scale - mx, reference[1] * scale - my
+    w, h = reference[2] * scale + 2*mx, reference[3] * scale + 2*my
+    return [x, y, w, h]
+
+## Región de búsqueda de la palabra clave, enderezada
+#
+# En lugar de enderezar la página entera se remuestrea sólo la región de
+# búsqueda (recortada a la imagen enderezada, como en detect_keypatch) más
+# el margen que usa el refinamiento. Devuelve (imagen, [x, y], roi): la
+# región, su esquina en la imagen enderezada y la región de búsqueda
+# relativa a ella.
+#
+# @param img            imagen sin enderezar
+# @param rectify        par (transformación, tamaño) de rotation_transform
+# @param roi            región de búsqueda [x, y, w, h] en la imagen enderezada
+# @param patch_shape    tamaño del patch de referencia
+# @param factor         factor de reducción de la búsqueda gruesa
+def warp_search_region(img, rectify, roi, patch_shape, factor=4):
+    tform, shape = rectify
+    ht, wt = patch_shape
+    x, y, w, h = [int(v) for v in roi]
+    x, y = max(x, 0), max(y, 0)
+    w = max(min(w, shape[1] - x), wt)
+    h = max(min(h, shape[0] - y), ht)
+
+    pad = 4 * factor
+    x0, y0 = max(x - pad, 0), max(y - pad, 0)
+    x1, y1 = min(x + w + pad, shape[1]), min(y + h + pad, shape[0])
+    window = Affine.translation(x0, y0).then(tform)
+    region = warp_sheared(img, window, (y1 - y0, x1 - x0), any_neighbour=True)
+    return region, [x0, y0], [x - x0, y - y0, w, h]
+
 ## Detección de palabra clave
 #
+# Búsqueda de grueso a fino: primero se buscan candidatos con la imagen y
+# el patch reducidos por `factor` (y sólo dentro de `roi`, si se indica), y
+# luego se refina cada candidato en la escala de procesamiento en una
+# ventana chica a su alrededor.
+#
+# Devuelve las coordenadas [[x, y]] de la esquina superior izquierda del
+# mejor candidato y su score (correlación normalizada, entre -1 y 1), para
+# poder marcar las detecciones poco confiables.
+#
 # @param img            imagen
 # @param template       patch de referencia
-def detect_keypatch(img, template):
-    simg = feature.match_template(img, template, pad_input=True)
-    simg = simg.clip(0, simg.max())
-    rel_thr = 0.75
-    peaks = feature.peak_local_max(simg, num_peaks=1, threshold_abs=rel_thr*(simg.max()-simg.min()), exclude_border=False)
+# @param roi            región de búsqueda [x, y, w, h] (None: toda la imagen)
+# @param factor         factor de reducción para la búsqueda gruesa
+# @param num_candidates cantidad de candidatos a refinar
+def detect_keypatch(img, template, roi=None, factor=4, num_candidates=3):
     ht, wt = template.shape
-    for i in range(len(peaks)):
-        peaks[i] = [peaks[i][1]-wt/2, peaks[i][0]-ht/2]
-
-    return peaks
+    if roi is None:
+        roi = [0, 0, img.shape[1], img.shape[0]]
+
+    # la región tiene que poder contener al patch
+    x, y, w, h = [int(v) for v in roi]
+    x, y = max(x, 0), max(y, 0)
+    w = max(min(w, img.shape[1] - x), wt)
+    h = max(min(h, img.shape[0] - y), ht)
+    region = crop(img, x, y, w, h)
+
+    # búsqueda gruesa
+    coarse_template = downscale(template, factor)
+    coarse = downscale(region, factor)
+    candidates = []
+    if min(coarse_template.shape) > 1 and coarse.shape[0] >= coarse_template.shape[0] \
+            and coarse.shape[1] >= coarse_template.shape[1]:
+        simg = feature.match_template(coarse, coarse_template)
+        candidates = feature.peak_local_max(simg, min_distance=1, num_peaks=num_candidates,
+                                            exclude_border=False).tolist()
+        if len(candidates) == 0:
+            candidates = [np.unravel_index(simg.argmax(), simg.shape)]
+        candidates = [[x + c*factor, y + r*factor] for r, c in candidates[:num_candidates]]
+        margin = 2 * factor
+    else:
+        # patch demasiado chico para reducirlo: búsqueda directa en la región
+        candidates = [[x, y]]
+        margin = max(w - wt, h - ht)
+
+    # refinamiento en escala de procesamiento
+    best, best_score = [x, y], -np.inf
+    for cx, cy in candidates:
+        wx, wy = cx - margin, cy - margin
+        window = crop(img, wx, wy, wt + 2*margin, ht + 2*margin)
+        simg = feature.match_template(window, template)
+        r, c = np.unravel_index(simg.argmax(), simg.shape)
+        if simg[r, c] > best_score:
+            best, best_score = [wx + c, wy + r], simg[r, c]
+
+    return np.array([best]), float(best_score)
 
 ## Extracción de "quads" a partir de líneas horizontales y verticales
 #
-# @param svg_file        modelo
+# Los extremos de las líneas se indexan en una grilla (ver spatial.py), así
+# que cada esquina se busca sólo entre las líneas de su vecindad.
+#
+# @param hlines          líneas horizontales
+# @param vlines          líneas verticales
+# @param max_candidates  cantidad máxima de hipótesis por esquina (las más
+#                        próximas); None para no limitarlas
 '''
      (A)     HL0        (B)
       +------------------+
@@ -174,37 +302,37 @@ def detect_keypatch(img, template):
       +------------------+
      (C)                (D)
 '''
-def detect_quads(hlines, vlines):
+def detect_quads(hlines, vlines, max_candidates=None):
 
     dthr = 10 #0.1 * np.min(vlines[:][6])
-    dthr = dthr*dthr
 
     quads = []
 
+    # índices de los extremos iniciales de las líneas
+    hgrid = PointGrid([hl[0:2] for hl in hlines], dthr)
+    vgrid = PointGrid([vl[0:2] for vl in vlines], dthr)
+    dthr = dthr*dthr
+
     for vl0 in vlines:
         vl0_p0 = vl0[0:2]
 
-        hl0_hyp = []
-        for hl0 in hlines:
-            hl0_p0 = hl0[0:2]
-            if sqdist(vl0_p0, hl0_p0) < dthr:
-                hl0_hyp.append(hl0)
-
+        hl0_hyp = [hlines[n] for n in hgrid.query(vl0_p0, max_candidates)]
         if len(hl0_hyp)==0:
             continue
 
         vl0_p1 = vl0[2:4]
 
-        hl1_hyp = []
-        for hl1 in hlines:
-            hl1_p0 = hl1[0:2]
-            if sqdist(vl0_p1, hl1_p0) < dthr:
-                hl1_hyp.append(hl1)
-
+        hl1_hyp = [hlines[n] for n in hgrid.query(vl0_p1, max_candidates)]
         if len(hl1_hyp)==0:
             continue
 
-        for vl1 in vlines:
+        # sólo pueden cerrar el quad las verticales que empiezan cerca de (B)
+        vl1_hyp = set()
+        for hl0 in hl0_hyp:
+            vl1_hyp.update(vgrid.query(hl0[2:4], max_candidates))
+
+        for n in sorted(vl1_hyp):
+            vl1 = vlines[n]
             vl1_p0 = vl1[0:2]
             vl1_p1 = vl1[2:4]
             for hl0 in hl0_hyp:
@@ -224,45 +352,77 @@ def detect_quads(hlines, vlines):
 
     return quads
 
-## Lectura de modelo a partir de archivo .svg
+## Overlap entre dos conjuntos de rectángulos
+#
+# Devuelve la matriz (N, M) con la raíz del cociente intersección / unión
+# entre cada par (0 si no se intersectan).
+#
+# @param a              array (N, 4) de rectángulos [x1, y1, x2, y2]
+# @param b              array (M, 4) de rectángulos [x1, y1, x2, y2]
+def overlap_matrix(a, b):
+    a = np.asarray(a, dtype='float64').reshape(-1, 1, 4)
+    b = np.asarray(b, dtype='float64').reshape(1, -1, 4)
+    w = np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0])
+    h = np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1])
+    inter = np.where((w > 0) & (h > 0), w * h, 0.)
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    union = area_a + area_b - inter
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(inter > 0, np.sqrt(inter / union), 0.)
+
+## Alineación del modelo de formulario con los cuadriláteros detectados
 #
-# @param svg_file        modelo
-def parse_model(svg_file):
-    doc = minidom.parse(svg_file)
-    tables = []
-    cells = []
-    x0, y0 = 0., 0.
-    for rect in doc.getElementsByTagName('rect'):
-        x = float(rect.getAttribute('x'))
-        y = float(rect.getAttribute('y'))
-        width = float(rect.getAttribute('width'))
-        height = float(rect.getAttribute('height'))
-        label = rect.getAttribute('inkscape:label').lstrip()
-        id = rect.getAttribute('id').lstrip()
-        if label=="REFERENCIA":
-            x0, y0 = x, y
-        elif label.find("TABLA") == 0:
-            tables.append([x, y, width, height, id])
-        elif label.find("CELDA") == 0:
-            cells.append([x, y, width, height, id])
-
-    image = doc.getElementsByTagName('image')
-    image_cx = float(image[0].getAttribute('x'))
-    image_cy = float(image[0].getAttribute('y'))
-
-    x0 = x0 - image_cx
-    y0 = y0 - image_cy
-
-    # refiere todo al patch de referencia
-    for i in range(len(tables)):
-        tables[i][0] = tables[i][0] - image_cx - x0
-        tables[i][1] = tables[i][1] - image_cy - y0
-
-    for i in range(len(cells)):
-        cells[i][0] = cells[i][0] - image_cx - x0
-        cells[i][1] = cells[i][1] - image_cy - y0
-
-    return tables, cells
+# Empareja cada quad con las tablas del modelo con las que se superpone
+# (overlap > min_match_overlap) y estima, a partir de las esquinas de los
+# pares, un escalado respecto de `origin` (mediana de los cocientes) y un
+# desplazamiento (mediana de los residuos). Luego aplica la transformación a
+# todas las tablas y celdas.
+#
+# Devuelve las tablas y celdas transformadas y un diccionario con la
+# cantidad de pares emparejados, el escalado, el desplazamiento y el
+# residuo del ajuste (mediana del error absoluto de las esquinas, en pixels).
+#
+# @param quads             lista de quads [x1, y1, x2, y2]
+# @param tables            array (N, 4) de tablas [x, y, w, h]
+# @param cells             array (M, 4) de celdas [x, y, w, h]
+# @param origin            punto fijo del escalado (la palabra clave)
+# @param min_match_overlap overlap mínimo para emparejar un quad con una tabla
+def align_model(quads, tables, cells, origin, min_match_overlap=0.5):
+    quads = np.asarray(quads, dtype='float64').reshape(-1, 4)
+    tables = np.asarray(tables, dtype='float64').reshape(-1, 4)
+    cells = np.asarray(cells, dtype='float64').reshape(-1, 4)
+    origin = np.array(origin, dtype='float64')
+
+    corners = np.c_[tables[:, 0:2], tables[:, 0:2] + tables[:, 2:4]]
+    overlap = overlap_matrix(quads, corners)
+    qi, mi = np.nonzero(overlap > min_match_overlap)
+
+    # esquinas emparejadas (x, y), relativas al origen
+    q = quads[qi].reshape(-1, 2) - origin
+    m = np.c_[tables[mi, 0:2], tables[mi, 0:2] + tables[mi, 2:4] - 1.0].reshape(-1, 2) - origin
+
+    scale, offset, residual = np.ones(2), np.zeros(2), None
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = q / m
+    for k in range(2):
+        valid = np.isfinite(ratio[:, k])
+        if valid.any():
+            scale[k] = np.median(ratio[valid, k])
+    if len(q) > 0:
+        error = q - m * scale
+        offset = np.median(error, axis=0)
+        residual = float(np.median(np.abs(error - offset)))
+
+    def transform(rects):
+        rects = rects.copy()
+        rects[:, 0:2] = (rects[:, 0:2] - origin) * scale + origin + offset
+        rects[:, 2:4] = rects[:, 2:4] * scale
+        return rects
+
+    info = {'matched': len(qi), 'scale': scale.tolist(), 'offset': offset.tolist(),
+            'residual': residual}
+    return transform(tables), transform(cells), info
 
 ## Procesa la celda para mandar al OCR
 #
@@ -360,12 +520,173 @@ def segment_digits(img):
 
     return bb
 
+# elementos estructurantes de las versiones por lotes (una celda por plano)
+_BATCH_SQUARE2 = morphology.square(2)[np.newaxis]
+_BATCH_SQUARE5 = morphology.square(5)[np.newaxis]
+_BATCH_DISK1 = morphology.disk(1)[np.newaxis]
+_BATCH_CONNECTIVITY = np.array([np.zeros((3, 3)), ndimage.generate_binary_structure(2, 1),
+                                np.zeros((3, 3))], dtype='bool')
+
+## Extiende cada fila de una máscara 2D desde su primer hasta su último True
+def _fill_span(mask):
+    return (mask.cumsum(axis=1) > 0) & (mask[:, ::-1].cumsum(axis=1) > 0)[:, ::-1]
+
+## Versión por lotes de process_cell
+#
+# Procesa juntas N celdas del mismo tamaño: los perfiles, filtros de mediana
+# y operaciones morfológicas se calculan sobre el array 3D, sin mezclar
+# celdas. El resultado es igual a apilar process_cell(cell) > 0.
+#
+# @param cells           array (N, alto, ancho) de celdas (tinta en True)
+def process_cells(cells):
+    cells = np.asarray(cells)
+    if not cells.dtype == 'bool':
+        cells = cells > 0
+    n, h, w = cells.shape
+
+    # máscaras para limpiar lineas largas verticales y horizontales
+    thr0 = cells.sum(axis=1) < 0.8 * h
+    thr1 = cells.sum(axis=2) < 0.5 * w
+    mask_lines = thr1[:, :, np.newaxis] & thr0[:, np.newaxis, :]
+    mask = morphology.binary_erosion(mask_lines, _BATCH_SQUARE5)
+    img1 = np.bitwise_and(mask, cells)
+
+    # región con dígitos, horizontal y verticalmente
+    sum0 = signal.medfilt(np.sum(img1, 1), [1, 5])
+    thr0 = _fill_span(sum0 > 0.8 * np.median(sum0, axis=1)[:, np.newaxis])
+    sum1 = signal.medfilt(np.sum(img1, 2), [1, 5])
+    thr1 = _fill_span(sum1 > 0.8 * np.median(sum1, axis=1)[:, np.newaxis])
+    mask = thr1[:, :, np.newaxis] & thr0[:, np.newaxis, :]
+    mask = morphology.binary_dilation(mask, _BATCH_SQUARE2)
+
+    img = mask_lines & cells
+    img = morphology.binary_dilation(img, _BATCH_DISK1)
+    img = morphology.binary_erosion(img, _BATCH_DISK1)
+    return np.bitwise_and(mask, img) > 0
+
+## Versión por lotes de segment_digits
+#
+# Devuelve una lista con los bounding-boxes de cada celda, iguales a los de
+# segment_digits(cell). (Si una celda tiene columnas con dígitos pero
+# ninguna fila, segment_digits falla; acá devuelve una lista vacía.)
+#
+# @param cells           array (N, alto, ancho) de celdas procesadas
+def segment_cells(cells):
+    cells = np.asarray(cells)
+    if not cells.dtype == 'bool':
+        cells = cells > 0
+    n, h, w = cells.shape
+
+    # elimina objetos chicos (componentes conexas dentro de cada celda)
+    labels, nlabels = ndimage.label(cells, _BATCH_CONNECTIVITY)
+    small = np.bincount(labels.ravel()) < 32
+    small[0] = False
+    img0 = cells & ~small[labels]
+
+    # filas con dígitos: primera y última (+2, como segment_digits)
+    bp1 = signal.medfilt(np.sum(img0, 2), [1, 5]) > 0
+    has_rows = bp1.any(axis=1)
+    top = bp1.argmax(axis=1)
+    bottom = h - bp1[:, ::-1].argmax(axis=1) + 1
+
+    # columnas donde empieza y termina cada dígito
+    bp0 = signal.medfilt(np.sum(img0, 1), [1, 5]) > 0
+    start_cell, start = np.nonzero(~bp0[:, :-1] & bp0[:, 1:])
+    end_cell, end = np.nonzero(bp0[:, :-1] & ~bp0[:, 1:])
+    start_count = np.bincount(start_cell, minlength=n)
+    end_count = np.bincount(end_cell, minlength=n)
+    start_first = np.cumsum(start_count) - start_count
+    end_first = np.cumsum(end_count) - end_count
+
+    bbs = []
+    for k in range(n):
+        bb = []
+        if start_count[k] == end_count[k] and has_rows[k]:
+            for i in range(start_count[k]):
+                bb.append([int(start[start_first[k] + i]) + 1, int(top[k]),
+                           int(end[end_first[k] + i]), int(bottom[k])])
+        bbs.append(bb)
+    return bbs
+
+## Recorte de tablas y celdas, limpieza de celdas y segmentación de dígitos
+#
+# Devuelve un diccionario ordenado nombre -> imagen con los mismos nombres
+# que usan los archivos de salida: 'CELDA_n' (recorte), 'CELDA_n-0' (celda
+# limpia), 'CELDA_n-k' (k-ésimo dígito) y 'TABLA_n'.
+#
+# @param base_img        imagen sobre la que se recorta (fondo en True)
+# @param tables          tablas del modelo [x, y, w, h, id]
+# @param cells           celdas del modelo [x, y, w, h, id]
+# @param processing_scale escala en la que están las coordenadas del modelo
+# @param page_tform      transformación (geometry.Affine) de las coordenadas
+#                        del modelo a la imagen; si se indica, cada recorte se
+#                        endereza (ver geometry.warp_fields)
+# @param digit_method    segmentación de dígitos: 'profile' (huecos del perfil
+#                        de columnas, segment_digits) o 'components'
+#                        (componentes conexas, ver digits.py)
+# @param tracer          registro de etapas (ver tracing.py): 'crop' y 'cells'
+def extract_crops(base_img, tables, cells, processing_scale, page_tform=None,
+                  digit_method='profile', tracer=None):
+    def fields_crops(fields):
+        if page_tform is None:
+            return crop_fields(base_img, fields, processing_scale)
+        return warp_fields(base_img, fields, page_tform, processing_scale)
+
+    if tracer is not None:
+        tracer.begin('crop')
+    cell_crops = fields_crops(cells)
+    table_crops = fields_crops(tables)
+
+    # limpieza de celdas y segmentación de dígitos, por lotes de celdas del
+    # mismo tamaño
+    groups = OrderedDict()
+    for id, subimg in cell_crops.items():
+        groups.setdefault(subimg.shape, []).append(id)
+    if tracer is not None:
+        tracer.begin('cells')
+        tracer.count(cells=len(cell_crops), cell_groups=len(groups))
+    cleaned, bounding_boxes = {}, {}
+    for ids in groups.values():
+        stack = np.bitwise_not(np.array([cell_crops[id] for id in ids]))
+        stack = process_cells(stack)
+        if digit_method == 'components':
+            boxes = [segment_components(subimg) for subimg in stack]
+        else:
+            boxes = segment_cells(stack)
+        for id, subimg, bb in zip(ids, stack, boxes):
+            # invierte antes de guardar
+            cleaned[id] = np.bitwise_not(subimg)
+            bounding_boxes[id] = bb
+
+    crops = OrderedDict()
+    for id, subimg in cell_crops.items():
+        crops[id] = subimg
+        crops[id + '-0'] = cleaned[id]
+        for k in range(len(bounding_boxes[id])):
+            crops[id + '-' + str(k+1)] = crop_box(cleaned[id], bounding_boxes[id][k], True)
+
+    crops.update(table_crops)
+    return crops
+
+## Guarda los recortes como imágenes
+#
+# @param base_name       prefijo de los archivos (path sin extensión del telegrama)
+# @param crops           recortes devueltos por extract_crops
+# @param img_ext         extensión (formato) de las imágenes
+def save_crops(base_name, crops, img_ext='.jpg'):
+    # skimage.io importa pyplot: el backend se elige antes (ver preview.py)
+    from preview import use_agg
+    use_agg()
+    from skimage import io
+    for name, subimg in crops.items():
+        io.imsave(base_name + '-' + name + img_ext, subimg.astype('float64'))
+
 
 # ----------------------------------------------------------------------
 
 import os, sys
-import matplotlib.pyplot as plt
-import matplotlib.cm as cm
+import argparse
+import registry
 
 PATH = os.path.dirname(os.path.abspath(__file__))
 
@@ -376,211 +697,216 @@ PATH = os.path.dirname(os.path.abspath(__file__))
 keyword_file = PATH + '/templates/keyword.pbm'
 model_file = PATH + '/templates/CordobaOct2013.svg'
 
+# estimador de la rotación del formulario ('hough' o 'projection')
+rotation_method = 'hough'
+
+# detector de líneas horizontales y verticales ('hough' o 'runlength')
+line_method = 'runlength'
+
+# segmentación de dígitos ('profile' o 'components')
+digit_method = 'components'
+
+# por debajo de este score la detección de la palabra clave se marca como dudosa
+min_keypatch_score = 0.5
+
 def main():
+    parser = argparse.ArgumentParser(description="Procesamiento de un telegrama")
+    parser.add_argument("image_file", help="imagen del telegrama")
+    parser.add_argument("--no-preview", dest="preview", action="store_false",
+                        help="no generar la vista previa (-PREVIEW.jpg)")
+    parser.add_argument("--jpeg", action="store_true",
+                        help="guardar los recortes como JPEG sueltos (formato anterior) "
+                             "en lugar del contenedor " + CONTAINER_SUFFIX)
+    parser.add_argument("--trace", metavar="ARCHIVO",
+                        help="agregar los tiempos y la memoria de cada etapa a un "
+                             "archivo de trazas (ver tracing.py)")
+    parser.add_argument("--classifier", metavar="MODELO",
+                        help="clasificador de dígitos entrenado (ver digit/digit.py) "
+                             "para leer los dígitos de las celdas")
+    args = parser.parse_args()
     try:
-        image_file = os.path.join(PATH, sys.argv[1])
-        process_telegram(image_file)
+        image_file = os.path.join(PATH, args.image_file)
+        classifier = None
+        if args.classifier:
+            classifier = load_classifier(args.classifier)
+        tracer = Tracer(image_file)
+        process_telegram(image_file, preview=args.preview, jpeg=args.jpeg,
+                         classifier=classifier, tracer=tracer)
+        if args.trace:
+            write_trace(args.trace, tracer.record())
     except Exception, e:
         print >>sys.stderr, "Uso: python telegrama/telegrama.py archivo_telegrama.\n"
         print e
         return 0
 
-def process_telegram(image_file):
-    # levanta imagen
-    img1 = load_image(image_file)
+## Levanta un clasificador de dígitos guardado con BaseDigitClassifier.save
+#
+# @param path            path del modelo
+def load_classifier(path):
+    sys.path.insert(0, os.path.join(PATH, '..'))
+    from digit.digit import BaseDigitClassifier
+    return BaseDigitClassifier.load(path)
 
-    # achico la imagen para acelerar el procesamiento
+## Procesa un telegrama y guarda los recortes
+#
+# @param image_file      path a la imagen del telegrama
+# @param out_base        prefijo de los archivos de salida (por defecto el path
+#                        de la imagen sin extensión)
+# @param preview         si es True, genera además la vista previa (-PREVIEW.jpg)
+# @param jpeg            si es True, guarda los recortes como JPEG sueltos en
+#                        lugar del contenedor (-CROPS.npz, ver container.py)
+# @param classifier      clasificador de dígitos (ver digit/digit.py); si se
+#                        indica, todos los dígitos del telegrama se clasifican
+#                        en una sola llamada a batch_classify
+# @param tracer          registro del tiempo y la memoria de cada etapa (ver
+#                        tracing.py)
+def process_telegram(image_file, out_base=None, preview=False, jpeg=False, classifier=None,
+                     tracer=None):
+    if tracer is None:
+        tracer = Tracer(image_file)
+
+    # levanta imagen (empaquetada: 8 pixels por byte)
+    tracer.begin('load')
+    img1 = load_image(image_file, packed=True)
+
+    # achico la imagen para acelerar el procesamiento (cada pixel es el OR
+    # de un bloque de 2x2, sin pasar por una copia en punto flotante)
     processing_scale = 0.5
-    img2 = transform.rescale(img1, processing_scale)
-    img2 = img2 > 0
+    tracer.begin('rescale')
+    img2 = img1.reduce2().unpack()
 
     # operaciones morfológicas (preproc.)
     elem = morphology.square(2)
     #img2 = morphology.binary_dilation(img2, elem)
+    tracer.begin('small_objects')
     img3 = morphology.remove_small_objects(img2, min_size=64, connectivity=8)
 
-    # estimacion de orientación + rectificación
-    alpha = estimate_rotation(img3)
-    img4 = transform.rotate(img3, angle=alpha, resize=True)
-    print '  alpha =', str(alpha * 180. / np.math.pi)
+    # estimacion de orientación + rectificación (sin pasar a punto flotante;
+    # ver geometry.py)
+    tracer.begin('rotation')
+    alpha = estimate_rotation(img3, rotation_method)
+    tracer.count(alpha=alpha)
+    # la página no se endereza: las detecciones se hacen sobre img3 y se
+    # llevan a coordenadas enderezadas
+    rectify, rectified_shape = rotation_transform(img3.shape, alpha)
+    print '  alpha =', alpha
 
     # detección de lineas horiz y vert
-    hlines, vlines = detect_lines(img4, False)
+    tracer.begin('lines')
+    hlines, vlines = detect_lines(img3, True, line_method, (rectify, rectified_shape))
+    tracer.count(lines=len(hlines) + len(vlines))
     print '  lines =', len(hlines) + len(vlines)
 
-    # detección de la palabra TELEGRAMA
-    keypatch = load_image(keyword_file)
-    keypatch = transform.rescale(keypatch, processing_scale)
-    peaks = detect_keypatch(img4, keypatch)
+    # modelo de formulario (parseado una sola vez por proceso)
+    tracer.begin('keypatch')
+    template = registry.get_template(model_file, keyword_file, (processing_scale,))
+
+    # detección de la palabra TELEGRAMA (sólo se endereza la región de búsqueda)
+    keypatch = template['keypatch'][processing_scale]
+    roi = keypatch_search_region(template['reference'], processing_scale, rectified_shape)
+    region, origin, roi = warp_search_region(img3, (rectify, rectified_shape), roi,
+                                             keypatch.shape)
+    peaks, keypatch_score = detect_keypatch(region, keypatch, roi)
+    peaks = peaks + origin
     hk, wk = keypatch.shape
-    print '  keypatch coord =', (peaks[0][0], peaks[0][1])
+    tracer.count(keypatch_score=keypatch_score)
+    print '  keypatch coord =', (peaks[0][0], peaks[0][1]), 'score =', keypatch_score
+    if keypatch_score < min_keypatch_score:
+        print >>sys.stderr, '  ATENCION: palabra clave detectada con baja confianza'
 
     # cuadriláteros
+    tracer.begin('quads')
     quads = detect_quads(hlines, vlines)
+    tracer.count(quads=len(quads))
     print '  quads =', len(quads)
 
-    # modelo de formulario
-    tables, cells = parse_model(model_file)
+    # tablas y celdas del modelo
+    tracer.begin('align')
+    tables, cells = registry.model_fields(template)
     print '  svg tables =', len(tables), '/ cells =', len(cells)
 
     # coordenadas referidas al keyword detectado
     x0, y0 = peaks[0]
-    for i in range(len(tables)):
-        tables[i][0] = tables[i][0] * processing_scale + x0
-        tables[i][1] = tables[i][1] * processing_scale + y0
-        tables[i][2] = tables[i][2] * processing_scale
-        tables[i][3] = tables[i][3] * processing_scale
-
-    for i in range(len(cells)):
-        cells[i][0] = cells[i][0] * processing_scale + x0
-        cells[i][1] = cells[i][1] * processing_scale + y0
-        cells[i][2] = cells[i][2] * processing_scale
-        cells[i][3] = cells[i][3] * processing_scale
-
-    # Overlap de cuadrilateros y modelo
-    overlap = []
-    for i in range(len(quads)):
-        overlap.append([0] * len(tables))
-
-    for i in range(len(quads)):
-        x1q, y1q, x2q, y2q = quads[i][0:4]
-        area_q = (y2q - y1q) * (x2q - x1q)
-        for j in range(len(tables)):
-            x1m, y1m, x2m, y2m = tables[j][0], tables[j][1], tables[j][0]+tables[j][2], tables[j][1]+tables[j][3]
-            area_m = (y2m - y1m) * (x2m - x1m)
-
-            x1_inter = max(x1q, x1m)
-            x2_inter = min(x2q, x2m)
-            y1_inter = max(y1q, y1m)
-            y2_inter = min(y2q, y2m)
-
-            if y2_inter > y1_inter and x2_inter > x1_inter:
-                area_inter = (y2_inter - y1_inter) * (x2_inter - x1_inter)
-                area_union = area_q + area_m - area_inter
-                overlap[i][j] = np.math.sqrt(area_inter / area_union)
-
-    # estimar escalado que alinea los quads detectados con el modelo
-    min_match_overlap = 0.5
-    xratio, yratio = [], []
-    for i in range(len(quads)):
-        x1q, y1q, x2q, y2q = quads[i][0:4]
-        for j in range(len(tables)):
-            x1m, y1m, x2m, y2m = tables[j][0], tables[j][1], tables[j][0]+tables[j][2]-1.0, tables[j][1]+tables[j][3]-1.0
-            if overlap[i][j] > min_match_overlap:
-                yratio.append((y1q-y0) / (y1m-y0))
-                yratio.append((y2q-y0) / (y2m-y0))
-                xratio.append((x1q-x0) / (x1m-x0))
-                xratio.append((x2q-x0) / (x2m-x0))
-    print '  overlaping quads =', len(xratio)
-
-    median_xratio = 1.0
-    if len(xratio) > 0:
-        median_xratio = np.median(xratio)
-
-    median_yratio = 1.0
-    if len(yratio) > 0:
-        median_yratio = np.median(yratio)
-
-    for i in range(len(tables)):
-        tables[i][0] = (tables[i][0] - x0) * median_xratio + x0
-        tables[i][1] = (tables[i][1] - y0) * median_yratio + y0
-        tables[i][2] = (tables[i][2] - x0) * median_xratio + x0
-        tables[i][3] = (tables[i][3] - y0) * median_yratio + y0
-
-    for i in range(len(cells)):
-        cells[i][0] = (cells[i][0] - x0) * median_xratio + x0
-        cells[i][1] = (cells[i][1] - y0) * median_yratio + y0
-        cells[i][2] = (cells[i][2] - x0) * median_xratio + x0
-        cells[i][3] = (cells[i][3] - y0) * median_yratio + y0
-
-    # crop de celdas en img original
-    base_img = img1
-    if not base_img is img1:
-        processing_scale = 1.0
-    base_img = np.bitwise_not(base_img);
-    base_name = image_file[:image_file.rfind(".")]
+    table_rects, table_ids = registry.fields_to_arrays(tables)
+    cell_rects, cell_ids = registry.fields_to_arrays(cells)
+    table_rects = table_rects * processing_scale + [x0, y0, 0, 0]
+    cell_rects = cell_rects * processing_scale + [x0, y0, 0, 0]
+
+    # alineación del modelo con los cuadriláteros detectados
+    table_rects, cell_rects, alignment = align_model(quads, table_rects, cell_rects, (x0, y0))
+    print '  overlaping quads =', alignment['matched'], '/ residual =', alignment['residual']
+    tracer.count(matched=alignment['matched'], residual=alignment['residual'])
+    tables = registry.arrays_to_fields(table_rects, table_ids)
+    cells = registry.arrays_to_fields(cell_rects, cell_ids)
+
+    # transformaciones a la página original: desde la imagen enderezada y
+    # desde el modelo (escala, alineación y posición de la palabra clave)
+    page_tform = rectify.then(Affine.scaling(1. / processing_scale))
+    sx, sy = alignment['scale']
+    ox, oy = alignment['offset']
+    model_tform = Affine.scaling(processing_scale * sx, processing_scale * sy) \
+        .then(Affine.translation(x0 + ox, y0 + oy)).then(page_tform)
+
+    # crop de celdas en img original (sólo se endereza cada ventana)
+    base_img = img1.invert()
+    base_name = out_base
+    if base_name is None:
+        base_name = image_file[:image_file.rfind(".")]
 
     # elem = morphology.square(2)
     # base_img = morphology.binary_dilation(base_img, elem)
     # base_img = morphology.binary_erosion(base_img, elem)
 
     # cropear celdas y tablas para guardar
-    img_ext = '.jpg'
-    for elem in (cells, tables):
-        for n in range(len(elem)):
-            x1, y1, w, h, id = elem[n]
-            x1 = int(x1 / processing_scale)
-            y1 = int(y1 / processing_scale)
-            w = int(w / processing_scale)
-            h = int(h / processing_scale)
-            x2 = min(x1+w-1, base_img.shape[1]-1)
-            y2 = min(y1+h-1, base_img.shape[0]-1)
-
-            subimg = np.zeros([h, w], dtype='bool')
-            for i in range(y1, y2+1):
-                for j in range(x1, x2+1):
-                    subimg[i-y1][j-x1] = base_img[i][j]
-
-            subimg_name = base_name + '-' + elem[n][4]
-            io.imsave(subimg_name + img_ext, subimg.astype('float64'))
-
-            if elem[n] in cells:
-                # limpia la celda tratando de dejar solo los números
-                subimg = process_cell(np.bitwise_not(subimg))
-
-                # segmentación de dígitos dentro de la subimagen
-                bounding_boxes = segment_digits(subimg)
-
-                # invierte antes de guardar
-                subimg = np.bitwise_not(subimg)
-                io.imsave(subimg_name + '-0' + img_ext, subimg.astype('float64'))
-
-                for k in range(len(bounding_boxes)):
-                    bb = bounding_boxes[k]
-                    bbh, bbw = bb[3]-bb[1]+1, bb[2]-bb[0]+1
-                    digit = np.zeros([bbh, bbw], dtype='bool')
-                    for i in range(bb[1], bb[3]+1):
-                        for j in range(bb[0], bb[2]+1):
-                            digit[i-bb[1]][j-bb[0]] = subimg[i][j]
-                    io.imsave(subimg_name + '-' + str(k+1) + img_ext, digit.astype('float64'))
-
+    crops = extract_crops(base_img, tables, cells, processing_scale, page_tform,
+                          digit_method, tracer)
+    tracer.count(crops=len(crops))
+
+    # dígitos normalizados al formato de los clasificadores: (N, 784) uint8
+    tracer.begin('digits')
+    samples, sample_names = digit_samples(crops)
+    print '  digits =', len(sample_names)
+    tracer.count(digits=len(sample_names))
+
+    # resultados de la detección, para generar la vista previa (ahora o después)
+    detections = {
+        'image': os.path.abspath(image_file),
+        'processing_scale': processing_scale,
+        'alpha': alpha,
+        'keypatch': [[pk[0], pk[1], wk, hk] for pk in peaks],
+        'keypatch_score': keypatch_score,
+        'quads': quads,
+        'tables': tables,
+        'cells': cells,
+        'alignment': alignment,
+        'rectify': {'matrix': rectify.tolist(), 'shape': rectified_shape},
+        'model_to_page': model_tform.tolist(),
+    }
+    if classifier is not None:
+        # valor y confianza de cada dígito (entropía y diferencia entre las
+        # dos clases más probables), en una sola pasada del clasificador
+        values, _, entropy, margin = classifier.batch_classify_with_probabilities(samples)
+        detections['digits'] = [[name, value, h, m] for name, value, h, m in
+                                zip(sample_names, values, entropy, margin)]
+
+    tracer.begin('write')
+    save_detections(base_name, detections)
+
+    # recortes: un único contenedor por telegrama (o los JPEG de antes)
+    if jpeg:
+        save_crops(base_name, crops)
+    else:
+        save_container(base_name + CONTAINER_SUFFIX, crops, detections,
+                       (samples, sample_names))
 
     # visualización
-    fig, (ax1, ax2) = plt.subplots(ncols=2)
-
-    ax1.imshow(img2, cmap=cm.Greys_r)
-    ax1.set_axis_off()
+    if preview:
+        tracer.begin('preview')
+        from preview import render_preview
+        render_preview(detections, base_name + '-PREVIEW.jpg', img2)
 
-    #palabra clave
-    for pk in peaks:
-        x, y = pk[0], pk[1]
-        feat = plt.Rectangle((x, y), wk, hk, edgecolor='r', facecolor='none', linewidth=2)
-        ax1.add_patch(feat)
-
-    #quads
-    for q in quads:
-        rect = plt.Rectangle((q[0], q[1]), q[2]-q[0], q[3]-q[1], edgecolor='y', facecolor='none', linewidth=2)
-        ax1.add_patch(rect)
-
-    ax2.imshow(img2, cmap=cm.Greys_r)
-    ax2.set_axis_off()
-
-    #tablas
-    x0, y0 = peaks[0]
-    for field in tables:
-        x, y = field[0], field[1]
-        w, h = field[2], field[3]
-        feat = plt.Rectangle((x, y), w, h, edgecolor='r', facecolor='none', linewidth=2)
-        ax2.add_patch(feat)
-
-    #celdas
-    for field in cells:
-        x, y = field[0], field[1]
-        w, h = field[2], field[3]
-        feat = plt.Rectangle((x, y), w, h, edgecolor='g', facecolor='none', linewidth=2)
-        ax2.add_patch(feat)
-
-    plt.savefig(base_name+'-PREVIEW.jpg', dpi=150)
+    tracer.end()
+    return crops
 
 if __name__ == "__main__":
     sys.exit(main())
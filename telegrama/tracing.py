@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+## Trazas de tiempo y memoria por etapa
+#
+# process_telegram marca el comienzo de cada etapa (carga, reducción,
+# limpieza, estimación y corrección de la rotación, líneas, palabra clave,
+# cuadriláteros, alineación, recorte, celdas, dígitos, escritura) en un
+# Tracer, que registra para cada una el tiempo real, el tiempo de CPU, el
+# pico de memoria residente (RSS) del proceso al terminarla, cuánto creció
+# ese pico durante la etapa y los contadores que el procesamiento ya informa
+# (ángulo, líneas, cuadriláteros, ...).
+#
+# Cada telegrama es una línea JSON de un archivo de trazas:
+#
+#   {"source": ..., "pid": ..., "start": ..., "wall": ..., "peak_rss_mb": ...,
+#    "stages": [{"stage": "load", "wall": ..., "cpu": ..., "peak_rss_mb": ...,
+#                "rss_growth_mb": ..., "counts": {...}}, ...]}
+#
+# Resumen de una corrida (percentiles por etapa):
+#
+#   $ python telegrama/tracing.py RESULTADOS/traces.jsonl
+
+import os, sys
+import argparse
+import json
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+TRACE_NAME = 'traces.jsonl'
+
+## Pico de memoria residente del proceso, en MB
+#
+# Es el máximo desde que arrancó el proceso (en un worker de batch.py, el
+# máximo de todos los telegramas que procesó hasta ahora).
+def peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss está en KB en Linux y en bytes en OS X
+    if sys.platform == 'darwin':
+        return rss / (1024. * 1024.)
+    return rss / 1024.
+
+## Registro de las etapas del procesamiento de un telegrama
+#
+#   tracer = Tracer('telegrama.pbm')
+#   tracer.begin('load')
+#   ...
+#   tracer.begin('lines')             # termina la etapa anterior
+#   tracer.count(lines=len(lines))
+#   tracer.end()
+#   write_trace(path, tracer.record())
+class Tracer(object):
+
+    ## @param source     identificación del telegrama (path)
+    def __init__(self, source=None):
+        self.source = source
+        self.stages = []
+        self._start = time.time()
+        self._current = None
+
+    ## Comienza una etapa (y termina la que estuviera en curso)
+    def begin(self, stage):
+        self.end()
+        self._current = OrderedDict([('stage', stage), ('counts', OrderedDict())])
+        self._current['_wall'] = time.time()
+        self._current['_cpu'] = time.clock()
+        self._current['_rss'] = peak_rss_mb()
+
+    ## Termina la etapa en curso
+    def end(self):
+        current = self._current
+        if current is None:
+            return
+        self._current = None
+        current['wall'] = time.time() - current.pop('_wall')
+        current['cpu'] = time.clock() - current.pop('_cpu')
+        current['peak_rss_mb'] = peak_rss_mb()
+        rss = current.pop('_rss')
+        current['rss_growth_mb'] = None if rss is None else current['peak_rss_mb'] - rss
+        self.stages.append(current)
+
+    ## Registra contadores en la etapa en curso (o en la última terminada)
+    def count(self, **counts):
+        stage = self._current if self._current is not None else \
+            (self.stages[-1] if self.stages else None)
+        if stage is not None:
+            stage['counts'].update(counts)
+
+    ## Traza del telegrama como diccionario (termina la etapa en curso)
+    def record(self):
+        self.end()
+        return OrderedDict([
+            ('source', self.source),
+            ('pid', os.getpid()),
+            ('start', self._start),
+            ('wall', sum(stage['wall'] for stage in self.stages)),
+            ('peak_rss_mb', peak_rss_mb()),
+            ('stages', self.stages),
+        ])
+
+## Conversión de tipos de numpy para json.dump (argumento `default`)
+def to_builtin(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(repr(obj))
+
+## Agrega la traza de un telegrama a un archivo de trazas
+#
+# @param path           archivo de trazas (JSON lines)
+# @param record         traza (ver Tracer.record)
+def write_trace(path, record):
+    with open(path, 'a') as f:
+        f.write(json.dumps(record, default=to_builtin) + '\n')
+
+## Lee un archivo de trazas (las líneas incompletas se ignoran)
+#
+# @param path           archivo de trazas
+def load_traces(path):
+    records = []
+    with open(path) as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+## Estadísticas por etapa de un conjunto de trazas
+#
+# Devuelve un diccionario ordenado etapa -> {'n', 'total', 'mean', 'p50',
+# 'p95', 'p99', 'max', 'cpu', 'peak_rss_mb', 'rss_growth_mb'}, con los
+# tiempos en segundos, más la entrada 'total' con el tiempo de cada telegrama
+# completo. 'rss_growth_mb' es el máximo crecimiento del pico de memoria en la
+# etapa: las etapas que lo mueven son las que fijan el consumo de memoria.
+#
+# @param records        trazas (ver load_traces)
+# @param percentiles    percentiles a calcular
+def summarize(records, percentiles=(50, 95, 99)):
+    walls, cpus, rss, growth = OrderedDict(), {}, {}, {}
+    for record in records:
+        for stage in record['stages']:
+            name = stage['stage']
+            walls.setdefault(name, []).append(stage['wall'])
+            cpus.setdefault(name, []).append(stage.get('cpu') or 0.)
+            if stage.get('peak_rss_mb') is not None:
+                rss[name] = max(rss.get(name, 0.), stage['peak_rss_mb'])
+            if stage.get('rss_growth_mb') is not None:
+                growth[name] = max(growth.get(name, 0.), stage['rss_growth_mb'])
+    walls['total'] = [record['wall'] for record in records]
+    cpus['total'] = [sum(stage.get('cpu') or 0. for stage in record['stages'])
+                     for record in records]
+    rss['total'] = max([record.get('peak_rss_mb') or 0. for record in records] or [0.])
+
+    summary = OrderedDict()
+    for name, values in walls.items():
+        values = np.array(values, dtype='float64')
+        stats = OrderedDict([('n', len(values)), ('total', values.sum()),
+                             ('mean', values.mean() if len(values) else 0.)])
+        for p in percentiles:
+            stats['p%d' % p] = np.percentile(values, p) if len(values) else 0.
+        stats['max'] = values.max() if len(values) else 0.
+        stats['cpu'] = float(np.sum(cpus[name]))
+        stats['peak_rss_mb'] = rss.get(name)
+        stats['rss_growth_mb'] = growth.get(name)
+        summary[name] = stats
+    return summary
+
+## Imprime el resumen por etapa como tabla
+#
+# @param summary        resultado de summarize
+# @param out            archivo de salida
+def print_summary(summary, out=sys.stdout):
+    def mb(value):
+        return '%8.1f' % value if value is not None else '%8s' % '-'
+
+    total = summary['total']['total'] if 'total' in summary else 0.
+    print >>out, '%-14s %6s %9s %6s %8s %8s %8s %8s %8s %8s' % (
+        'etapa', 'n', 'total[s]', '%', 'p50[ms]', 'p95[ms]', 'p99[ms]', 'max[ms]',
+        'rss[MB]', '+rss[MB]')
+    for name, stats in summary.items():
+        share = 100. * stats['total'] / total if total else 0.
+        print >>out, '%-14s %6d %9.2f %6.1f %8.1f %8.1f %8.1f %8.1f %s %s' % (
+            name, stats['n'], stats['total'], share, 1000 * stats['p50'],
+            1000 * stats['p95'], 1000 * stats['p99'], 1000 * stats['max'],
+            mb(stats['peak_rss_mb']), mb(stats['rss_growth_mb']))
+
+def main():
+    parser = argparse.ArgumentParser(description="Resumen de las trazas por etapa")
+    parser.add_argument("traces", nargs='+', help="archivos de trazas (" + TRACE_NAME + ")")
+    parser.add_argument("--json", action="store_true",
+                        help="imprimir el resumen como JSON en lugar de una tabla")
+    args = parser.parse_args()
+
+    records = []
+    for path in args.traces:
+        records.extend(load_traces(path))
+    if not records:
+        print >>sys.stderr, "No hay trazas"
+        return 1
+
+    summary = summarize(records)
+    if args.json:
+        print json.dumps(summary, indent=2, default=to_builtin)
+    else:
+        print '%d telegramas' % len(records)
+        print_summary(summary)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())